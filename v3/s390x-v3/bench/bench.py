@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Benchmarks on synthetic aws-lc / aws-c-common shaped trees and wheels.
+
+    python bench/bench.py --out results.json
+    python bench/bench.py --scale 4 --wheel-mb 64 --compare results.json
+
+Runs against the checkout's src/ tree and writes JSON results (min/median/mean seconds
+per benchmark) that can be compared across releases with --compare."""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import sysconfig
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+import s390x_auto_path  # noqa: E402
+from s390x_auto_path import libfix, validator  # noqa: E402
+
+_CMAKE = '''set(_IMPORT_PREFIX "${{CMAKE_CURRENT_LIST_DIR}}/../../..")
+set_target_properties({name} PROPERTIES
+  INTERFACE_INCLUDE_DIRECTORIES "${{_IMPORT_PREFIX}}/include"
+  INTERFACE_LINK_DIRECTORIES "${{_IMPORT_PREFIX}}/lib"
+  IMPORTED_LOCATION_RELEASE "${{_IMPORT_PREFIX}}/lib/lib{name}.so")
+'''
+_PC = 'prefix=/opt/{name}\nexec_prefix=${{prefix}}\nlibdir=${{exec_prefix}}/lib\nincludedir=${{prefix}}/include\n' \
+      'Name: {name}\nVersion: 1.0\nLibs: -L${{libdir}} -l{name}\nCflags: -I${{includedir}}\n'
+
+def _elf_sources():
+    """Real shared objects to copy into the trees so run_validate parses actual ELF files."""
+    return sorted(glob.glob(os.path.join(sysconfig.get_path('platstdlib'), 'lib-dynload', '*.so')))[:16]
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode()
+    path.write_bytes(data)
+
+def _lib(path, elves, i):
+    if elves:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(elves[i % len(elves)], str(path))
+    else:
+        _write(path, b'\x7fELF' + b'\0' * 60)
+
+def make_aws_lc(root, scale, elves):
+    """aws-lc layout: flat include/openssl, libs and cmake configs under lib/."""
+    for i in range(40 * scale):
+        _write(root / 'include' / 'openssl' / f'h{i}.h', f'/* header {i} */\n')
+    for i in range(4 * scale):
+        _lib(root / 'lib' / f'libcrypto{i}.so.1', elves, i)
+    for name in ('crypto', 'ssl'):
+        for i in range(2 * scale):
+            _write(root / 'lib' / name / 'cmake' / f'{name}{i}-config.cmake', _CMAKE.format(name=f'{name}{i}'))
+        _write(root / 'lib' / 'pkgconfig' / f'lib{name}.pc', _PC.format(name=name))
+    return root
+
+def make_aws_c_common(root, scale, elves):
+    """aws-c-common layout: deep include tree, mixed lib/lib64, nested wheel_payload cmake dirs."""
+    for i in range(10 * scale):
+        for sub in ('common', f'common/posix{i}', f'common/private/d{i}/e'):
+            _write(root / 'include' / 'aws' / sub / f'h{i}.h', '#pragma once\n')
+    for i in range(2 * scale):
+        _lib(root / 'lib64' / f'libaws-c-common{i}.so.1', elves, i)
+        _lib(root / 'lib' / f'libaws-c-legacy{i}.so', elves, i + 1)
+    for i in range(3 * scale):
+        comp = f'aws-c-comp{i}'
+        _write(root / 'wheel_payload' / 'lib64' / comp / 'cmake' / f'{comp}-config.cmake', _CMAKE.format(name=comp))
+        _write(root / 'wheel_payload' / 'lib64' / comp / 'cmake' / 'shared' / f'{comp}-targets.cmake', _CMAKE.format(name=comp))
+    _write(root / 'lib' / 'pkgconfig' / 'aws-c-common.pc', _PC.format(name='aws-c-common'))
+    return root
+
+def make_wheel(path, tree, size_mb, seed=0):
+    """Wheel holding `tree` plus ~size_mb of payload, half compressible, half random."""
+    rnd = random.Random(seed)
+    dist = 'synthetic-1.0.dist-info'
+    with zipfile.ZipFile(str(path), 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for f in sorted(tree.rglob('*')):
+            if f.is_file():
+                zf.write(str(f), 'synthetic/' + f.relative_to(tree).as_posix())
+        chunk = 1 << 20
+        for i in range(size_mb):
+            data = (b'padding %d\n' % i) * (chunk // 12) if i % 2 else rnd.getrandbits(8 * chunk).to_bytes(chunk, 'little')
+            zf.writestr(f'synthetic/data/blob{i}.bin', data)
+        zf.writestr(f'{dist}/METADATA', 'Metadata-Version: 2.1\nName: synthetic\nVersion: 1.0\n')
+        zf.writestr(f'{dist}/RECORD', '')
+    return path
+
+def _time(func, setup, repeat):
+    times = []
+    for _ in range(repeat):
+        arg = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times), 'repeat': repeat}
+
+def run(scale=1, wheel_mb=8, repeat=5):
+    elves = _elf_sources()
+    with tempfile.TemporaryDirectory(prefix='s390x-bench-') as tmp:
+        tmp = Path(tmp)
+        pristine = tmp / 'pristine'
+        lc = make_aws_lc(pristine / 'aws_lc', scale, elves)
+        common = make_aws_c_common(pristine / 'aws_c_common', scale, elves)
+        whl = make_wheel(tmp / 'synthetic-1.0-py3-none-any.whl', common, wheel_mb)
+        counter = [0]
+
+        def fresh(src):
+            def setup():
+                counter[0] += 1
+                dst = tmp / 'work' / str(counter[0])
+                shutil.copytree(str(src), str(dst), symlinks=True)
+                return dst
+            return setup
+
+        def extracted():
+            counter[0] += 1
+            work = tmp / 'work' / str(counter[0])
+            work.mkdir(parents=True)
+            out = work / whl.name
+            shutil.copyfile(str(whl), str(out))
+            ex = work / 'x'
+            with zipfile.ZipFile(str(out)) as zf:
+                zf.extractall(str(ex))
+            _write(ex / 'synthetic' / 'lib' / 'pkgconfig' / 'aws-c-common.pc', _PC.format(name='changed'))
+            return ex, out
+
+        fixed_lc = fresh(lc)()
+        libfix.fix_lib_layout(fixed_lc)
+        results = {
+            'find_subdirs': _time(libfix.find_subdirs, lambda: fixed_lc, repeat),
+            'fix_lib_layout': _time(libfix.fix_lib_layout, fresh(common), repeat),
+            'find_deep_cmake_dirs': _time(lambda p: libfix.find_deep_cmake_dirs_from_packages([p]), lambda: common, repeat),
+            'rewrite_cmake_paths': _time(libfix.rewrite_cmake_paths, fresh(common), repeat),
+            'repack_wheel': _time(lambda a: libfix.repack_wheel(*a), extracted, repeat),
+            'run_validate': _time(lambda p: validator.run_validate(p, use_cache=False), lambda: fixed_lc, repeat),
+        }
+    return {
+        'version': s390x_auto_path.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': {'scale': scale, 'wheel_mb': wheel_mb, 'repeat': repeat, 'elf_fixtures': len(elves)},
+        'results': results,
+    }
+
+def compare(new, old):
+    print(f"{'BENCHMARK':<24} {'OLD':>10} {'NEW':>10}  RATIO")
+    for name, r in new['results'].items():
+        base = old.get('results', {}).get(name)
+        if base:
+            print(f"{name:<24} {base['median']:10.4f} {r['median']:10.4f}  {r['median'] / base['median']:5.2f}x")
+        else:
+            print(f"{name:<24} {'-':>10} {r['median']:10.4f}")
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='bench.py', description=__doc__.split('\n')[0])
+    p.add_argument('--scale', type=int, default=1, help='multiplies the number of headers, libs and cmake files')
+    p.add_argument('--wheel-mb', type=int, default=8, help='payload size of the synthetic wheel in MiB')
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--out', help='write JSON results here (default: stdout)')
+    p.add_argument('--compare', help='previous JSON results to compare medians against')
+    args = p.parse_args(argv)
+    data = run(args.scale, args.wheel_mb, args.repeat)
+    text = json.dumps(data, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + '\n')
+        print(f'[OK] wrote results to {args.out}')
+    else:
+        print(text)
+    if args.compare:
+        compare(data, json.loads(Path(args.compare).read_text()))
+    return data
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Startup cost of each CLI subcommand, measured with `python -X importtime`.
+
+    python bench/startup.py --out startup.json
+    python bench/startup.py --repeat 20 --compare startup.json
+
+Every case runs the CLI in a fresh interpreter (against the checkout's src/ tree, a
+throwaway cache dir and tiny inputs, so the work itself is negligible) and records the
+wall time, the summed import time, the number of modules loaded and which package and
+heavy stdlib modules were imported. --compare prints median ratios against an earlier run."""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / 'src'
+
+# stdlib modules a subcommand should only load when it needs them
+HEAVY = ('argparse', 'asyncio', 'concurrent.futures', 'glob', 'hashlib', 'importlib.metadata', 'shutil',
+         'socket', 'socketserver', 'subprocess', 'tempfile', 'zipfile')
+
+_RUN = 'import sys; from s390x_auto_path.cli import main; sys.argv = ["s390x-auto-path"] + sys.argv[1:]; main()'
+
+def cases(work):
+    """{name: argv} covering every subcommand; --help where running it would block or touch a venv."""
+    pkg = work / 'pkg'
+    (pkg / 'lib').mkdir(parents=True, exist_ok=True)
+    return {
+        'help': ['--help'],
+        # default invocations probe for a daemon socket first (none is running here)
+        'scan': ['scan', 'no-such-package'],
+        'scan --no-daemon': ['--no-daemon', 'scan', 'no-such-package'],
+        'env generate': ['env', 'generate', str(work / 'build_env.sh'), 'no-such-package'],
+        'env generate --no-daemon': ['--no-daemon', 'env', 'generate', str(work / 'build_env.sh'), 'no-such-package'],
+        'fix --dry-run': ['fix', '--dry-run', str(pkg)],
+        'fix': ['fix', str(pkg)],
+        'validate': ['validate', '--no-cache', str(pkg)],
+        'validate --no-daemon': ['--no-daemon', 'validate', '--no-cache', str(pkg)],
+        'patch-rpath': ['patch-rpath', str(pkg)],
+        'inject-sitecustomize --help': ['inject-sitecustomize', '--help'],
+        'serve --help': ['serve', '--help'],
+        'watch --help': ['watch', '--help'],
+        'cache clear': ['cache', 'clear'],
+    }
+
+def parse_importtime(stderr):
+    """{module: self microseconds} from -X importtime output."""
+    mods = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        mods[name.strip()] = int(self_us)
+    return mods
+
+def measure(argv, env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _RUN] + argv, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    return wall, parse_importtime(proc.stderr)
+
+def run(repeat=10):
+    with tempfile.TemporaryDirectory(prefix='s390x-startup-') as tmp:
+        work = Path(tmp)
+        # the default socket path is computed as usual, under an empty runtime dir
+        env = dict(os.environ, PYTHONPATH=str(SRC), XDG_CACHE_HOME=str(work / 'cache'), XDG_RUNTIME_DIR=str(work))
+        env.pop('S390X_AUTO_PATH_SOCKET', None)
+        results = {}
+        for name, argv in cases(work).items():
+            walls, imports, mods = [], [], {}
+            for _ in range(repeat):
+                wall, mods = measure(argv, env)
+                walls.append(wall)
+                imports.append(sum(mods.values()) / 1e6)
+            results[name] = {
+                'argv': argv,
+                'median': statistics.median(walls),
+                'min': min(walls),
+                'import_median': statistics.median(imports),
+                'modules': len(mods),
+                'package_modules': sorted(m for m in mods if m.startswith('s390x_auto_path')),
+                'heavy_modules': [m for m in HEAVY if m in mods],
+                'repeat': repeat,
+            }
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'params': {'repeat': repeat},
+        'results': results,
+    }
+
+def compare(new, old):
+    print(f"{'SUBCOMMAND':<28} {'OLD':>8} {'NEW':>8}  RATIO  {'IMPORT OLD':>10} {'NEW':>8}  RATIO")
+    for name, r in new['results'].items():
+        base = old.get('results', {}).get(name)
+        if base:
+            print(f"{name:<28} {base['median']:8.4f} {r['median']:8.4f}  {r['median'] / base['median']:4.2f}x"
+                  f"  {base['import_median']:10.4f} {r['import_median']:8.4f}  {r['import_median'] / base['import_median']:4.2f}x")
+        else:
+            print(f"{name:<28} {'-':>8} {r['median']:8.4f}")
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog='startup.py', description=__doc__.split('\n')[0])
+    p.add_argument('--repeat', type=int, default=10)
+    p.add_argument('--out', help='write JSON results here (default: stdout)')
+    p.add_argument('--compare', help='previous JSON results to compare medians against')
+    args = p.parse_args(argv)
+    data = run(args.repeat)
+    text = json.dumps(data, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + '\n')
+        print(f'[OK] wrote results to {args.out}')
+    else:
+        print(text)
+    if args.compare:
+        compare(data, json.loads(Path(args.compare).read_text()))
+    return data
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,9 @@
 __version__='1.2.0'
-__all__=['cli','libfix','envgen','validator']
+__all__=['cli','libfix','envgen','validator','resolver','fsindex','cache','elf','wheel','rewriter','batch','wheelhouse','daemon','watch','profiling','output','soindex','runner','api']
+
+def __getattr__(name):
+    # Session pulls in every worker module; loaded on first use so the CLI starts fast
+    if name == 'Session':
+        from .api import Session
+        return Session
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
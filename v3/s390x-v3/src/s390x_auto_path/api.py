@@ -0,0 +1,197 @@
+import contextlib
+import importlib
+import io
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from . import cache, envgen, fsindex, libfix, output, resolver, validator
+
+# sys.stdout is process-wide: quiet calls redirect it one at a time, from any thread
+_stdout_lock = threading.RLock()
+
+@dataclass
+class ScanResult:
+    packages: Dict[str, Optional[Path]]
+    paths: Dict[str, List[str]]  # merged include/lib/lib64/pkgconfig/cmake/bin dirs (+ libdirs, in package order)
+
+    @property
+    def missing(self):
+        return [name for name, path in self.packages.items() if path is None]
+
+@dataclass
+class EnvResult:
+    env: Dict[str, str]  # CFLAGS, LDFLAGS, LD_LIBRARY_PATH, PKG_CONFIG_PATH, CMAKE_PREFIX_PATH
+    paths: Dict[str, List[str]]
+    out: Optional[str] = None
+    lib_farm: Optional[dict] = None  # envgen.build_lib_farm stats
+
+@dataclass
+class FixResult:
+    target: str
+    link_mode: str  # 'copy' for wheels
+    links: List[List[str]]  # [dst, src] relative to the target, planned or made
+    dry_run: bool = False
+    stats: Optional[dict] = None  # libfix.apply_layout stats (package dirs)
+    rewrite: Optional[dict] = None  # rewriter stats with rewrite_cmake
+    rewritten: bool = False  # wheels: the archive was rewritten
+
+    @property
+    def errors(self):
+        return (self.stats or {}).get('errors', [])
+
+@dataclass
+class Issue:
+    kind: str  # 'missing' or 'non_lib64'
+    soname: str
+    path: Optional[str] = None
+    fix: Optional[dict] = None  # soindex.suggest() result, with suggest=True
+
+@dataclass
+class SharedObject:
+    file: str
+    needed: List[str]
+    deps: Dict[str, Optional[str]]  # soname -> resolved path
+    issues: List[Issue] = field(default_factory=list)
+    cached: bool = False
+
+@dataclass
+class ValidateResult:
+    target: str
+    issues: int
+    libraries: List[SharedObject]
+
+    @property
+    def ok(self):
+        return self.issues == 0
+
+@dataclass
+class RpathFile:
+    file: str
+    status: str  # ok, unchanged, skipped or failed
+    detail: Optional[str] = None
+
+@dataclass
+class RpathResult:
+    target: str
+    rpath: str
+    files: List[RpathFile]
+
+class Session:
+    """Resolved packages, per-package scans and filesystem indexes kept across calls, so an
+    orchestrator running many builds in one process does not rescan unchanged packages.
+    State is checked against cache.fingerprint() (dist-info RECORD, top-level mtimes);
+    call invalidate() after changes it does not catch. Progress lines are suppressed
+    unless `verbose`. A session must not be shared between threads, but each thread may
+    use its own: records are captured per thread, and calls that suppress output are
+    serialized process-wide (sys.stdout is redirected), so they do not run concurrently."""
+
+    def __init__(self, use_cache=True, verbose=False):
+        self.use_cache = use_cache
+        self.verbose = verbose
+        self._resolved = {}
+        self._scans = {}  # envgen.cached_scan memo: {base: (fingerprint, scan)}
+        self._indexes = {}  # {target: (fingerprint, fsindex)}
+
+    def invalidate(self):
+        """Forget everything held (e.g. after pip installed or removed packages)."""
+        self._resolved.clear()
+        self._scans.clear()
+        self._indexes.clear()
+        importlib.invalidate_caches()
+
+    @contextlib.contextmanager
+    def _quiet(self):
+        if self.verbose:
+            yield
+            return
+        with _stdout_lock, contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+    def resolve(self, packages):
+        """{name: package dir or None}, looked up once per session."""
+        missing = [n for n in packages if n not in self._resolved]
+        if missing:
+            self._resolved.update(resolver.resolve_packages(missing))
+        return {n: self._resolved[n] for n in packages}
+
+    def index(self, target):
+        """The fsindex of a package dir, reused while its fingerprint is unchanged."""
+        key = str(target)
+        fp = cache.fingerprint(key)
+        hit = self._indexes.get(key)
+        if hit is None or fp is None or hit[0] != fp:
+            hit = (fp, fsindex.index_tree(key))
+            self._indexes[key] = hit
+        return hit[1]
+
+    def scan(self, packages):
+        """Resolve `packages` and list their include/lib/pkgconfig/cmake dirs from the held
+        indexes. Read-only, like the CLI `scan`: layouts are fixed by env() and fix()."""
+        resolved = self.resolve(packages)
+        scans = []
+        with self._quiet():
+            for pkg in packages:
+                base = resolved[pkg]
+                if base:
+                    index = self.index(base)
+                    scans.append({'parts': libfix.find_subdirs(base, index=index),
+                                  'cmake': libfix.find_deep_cmake_dirs_from_packages([base], indexes={str(base): index})})
+        return ScanResult(packages=resolved, paths=envgen.merge_scans(scans))
+
+    def env(self, packages, out=None, lib_farm=None, minimal=True):
+        """Fix and scan `packages` as `env generate` does and build their flags; written as a
+        shell file to `out` when given."""
+        resolved = self.resolve(packages)
+        farm = None
+        with self._quiet(), output.capture():
+            paths = envgen.collect_paths(packages, resolved=resolved, use_cache=self.use_cache,
+                                         memo=self._scans, indexes=self._indexes)
+            if lib_farm:
+                paths, farm = envgen.build_lib_farm(lib_farm, paths)
+            env = envgen.build_env_flags(paths, minimal=minimal)
+            if out:
+                envgen.write_shell(out, env)
+        return EnvResult(env=env, paths=paths, out=str(out) if out else None, lib_farm=farm)
+
+    def fix(self, target, rewrite_cmake=False, relocate=(), link_mode='symlink', dry_run=False):
+        """Fix a package dir or wheel like `fix`; with `dry_run` only report the plan."""
+        p = Path(target)
+        with self._quiet(), output.capture() as records:
+            if p.suffix == '.whl':
+                plan = libfix.plan_wheel_layout(p)
+                res = FixResult(target=str(p), link_mode='copy', links=plan['links'], dry_run=dry_run)
+                if not dry_run:
+                    res.rewritten = bool(libfix.fix_wheel(p, rewrite_cmake=rewrite_cmake, relocate=relocate))
+            else:
+                index = self.index(p)
+                plan = libfix.plan_layout(p, index, link_mode)
+                res = FixResult(target=str(p), link_mode=link_mode, links=plan['links'], dry_run=dry_run)
+                if not dry_run:
+                    res.stats = libfix.apply_layout(plan, index)
+                    if rewrite_cmake:
+                        libfix.rewrite_cmake_paths(p, relocate=relocate, index=index)
+                    # the index already has the new links; only the mtimes moved
+                    self._indexes[str(p)] = (cache.fingerprint(p), index)
+        rewrites = [r for r in records if r['type'] == 'rewrite']
+        if rewrites:
+            res.rewrite = {k: v for k, v in rewrites[-1].items() if k not in ('type', 'target')}
+        return res
+
+    def validate(self, target, sysroot='', suggest=False, jobs=None, ld_library_path=None):
+        """Check every shared object under a dir or wheel; see validator.run_validate."""
+        with self._quiet(), output.capture() as records:
+            issues = validator.run_validate(target, use_cache=self.use_cache, jobs=jobs, sysroot=sysroot,
+                                            ld_library_path=ld_library_path, suggest=suggest)
+        libs = [SharedObject(file=r['file'], needed=r['needed'], cached=r['cached'],
+                             deps={d['soname']: d['path'] for d in r['deps']},
+                             issues=[Issue(i['kind'], i['soname'], i['path'], i.get('fix')) for i in r['issues']])
+                for r in records if r['type'] == 'so']
+        return ValidateResult(target=str(target), issues=issues, libraries=sorted(libs, key=lambda so: so.file))
+
+    def patch_rpath(self, target, rpath='', jobs=None):
+        """Set the RPATH of every shared object under a dir or wheel (patchelf probed once per process)."""
+        with self._quiet(), output.capture() as records:
+            libfix.patch_rpath_target(target, rpath=rpath, jobs=jobs)
+        files = [RpathFile(r['file'], r['status'], r['detail']) for r in records if r['type'] == 'rpath']
+        return RpathResult(target=str(target), rpath=rpath or '/usr/lib64', files=files)
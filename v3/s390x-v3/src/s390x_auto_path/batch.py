@@ -0,0 +1,108 @@
+import contextlib
+import io
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from . import output, profiling
+
+def run_one(func, target, kwargs, capture, profile=False, fmt='text', records=None):
+    """Run func(target, **kwargs) and return a result dict (target, ok, value, error,
+    seconds; with `capture` also its stdout, trace events and records). With a `records`
+    queue, ndjson records are put on it as they are emitted instead of being returned."""
+    buf = io.StringIO()
+    start = time.monotonic()
+    ok, value, error = True, None, ''
+    if profile:
+        # pool worker: record from scratch (a forked worker inherits the parent's events)
+        # and ship the events back with the result
+        profiling.enable()
+    if capture and records is not None:
+        output.forward(records)
+    elif capture and fmt != 'text':
+        output.collect(fmt)  # records travel back with the result, like captured stdout
+    with (contextlib.redirect_stdout(buf) if capture else contextlib.nullcontext()):
+        try:
+            with profiling.phase(getattr(func, '__name__', 'target'), target=str(target)):
+                value = func(target, **kwargs)
+        except Exception as e:
+            ok, error = False, f'{type(e).__name__}: {e}'
+    return {'target': str(target), 'ok': ok, 'value': value, 'error': error,
+            'output': buf.getvalue(), 'seconds': time.monotonic() - start,
+            'trace': profiling.drain() if profile and capture else [],
+            'records': output.drain() if capture and fmt != 'text' else []}
+
+def split_jobs(jobs, ntargets):
+    """Split a worker budget into (processes across targets, threads per target)."""
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    procs = max(1, min(jobs, ntargets))
+    return procs, max(1, jobs // procs)
+
+def _forward(records, fut):
+    """Write records from the workers as they arrive until `fut` is done, then the rest."""
+    while not fut.done():
+        try:
+            output.emit(records.get(timeout=0.05))
+        except queue.Empty:
+            pass
+    while True:  # everything `fut` put is queued once it is done
+        try:
+            output.emit(records.get_nowait())
+        except queue.Empty:
+            return
+
+def _report(r):
+    for rec in r.pop('records', []):
+        output.emit(rec)
+    output.emit({'type': 'result', 'target': r['target'], 'ok': r['ok'], 'error': r['error'] or None,
+                 'seconds': round(r['seconds'], 6), 'value': r['value']})
+    if not r['ok']:
+        print(f"[ERR] {r['target']}: {r['error']}")
+
+def run_targets(func, targets, procs=1, **kwargs):
+    """Run func(target, **kwargs) for every target, isolating failures per target.
+
+    With procs > 1 targets run in a process pool; each worker's stdout is captured and
+    replayed in target order, so output never interleaves. ndjson records are forwarded
+    through a queue and written as they arrive (interleaved between targets); each
+    target's `result` record follows its own records. Returns one result dict per
+    target (target, ok, value, error, seconds), in input order."""
+    targets = list(dict.fromkeys(str(t) for t in targets))  # same target twice would race
+    results = []
+    if procs <= 1 or len(targets) <= 1:
+        for t in targets:
+            r = run_one(func, t, kwargs, capture=False)
+            _report(r)
+            results.append(r)
+        return results
+    fmt = output.current()
+    with contextlib.ExitStack() as stack:
+        records = None
+        if fmt == 'ndjson':
+            import multiprocessing
+            records = stack.enter_context(multiprocessing.Manager()).Queue()
+        ex = stack.enter_context(ProcessPoolExecutor(max_workers=procs))
+        futures = [ex.submit(run_one, func, t, kwargs, True, profiling.enabled(), fmt, records) for t in targets]
+        for t, fut in zip(targets, futures):
+            if records is not None:
+                _forward(records, fut)
+            try:
+                r = fut.result()
+            except Exception as e:  # worker died (e.g. BrokenProcessPool)
+                r = {'target': t, 'ok': False, 'value': None, 'error': f'{type(e).__name__}: {e}',
+                     'output': '', 'seconds': 0.0, 'trace': []}
+            profiling.merge(r.pop('trace'))
+            print(r['output'], end='')
+            _report(r)
+            results.append(r)
+    return results
+
+def print_summary(results):
+    width = max([len('TARGET')] + [len(r['target']) for r in results])
+    print(f"{'TARGET':<{width}}  STATUS  SECONDS")
+    for r in results:
+        status = 'ok' if r['ok'] else 'FAILED'
+        print(f"{r['target']:<{width}}  {status:<6}  {r['seconds']:7.2f}")
+    failed = sum(1 for r in results if not r['ok'])
+    print(f'[RESULT] {len(results) - failed} succeeded, {failed} failed')
+    return failed
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from .resolver import normalize_name
+
+# LRU bound on the number of cached entries; override with S390X_AUTO_PATH_CACHE_MAX
+DEFAULT_MAX_ENTRIES = 512
+
+def cache_dir():
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(root) / 's390x-auto-path'
+
+def _max_entries():
+    try:
+        return int(os.environ.get('S390X_AUTO_PATH_CACHE_MAX', DEFAULT_MAX_ENTRIES))
+    except ValueError:
+        return DEFAULT_MAX_ENTRIES
+
+def _entry_path(kind, key):
+    # the kind prefix lets values() skip other kinds (large soindex/elf entries) unparsed
+    h = hashlib.sha256(f'{kind}\0{key}'.encode()).hexdigest()
+    return cache_dir() / f'{kind}-{h}.json'
+
+def find_record(base_dir):
+    """RECORD of the dist-info that installed `base_dir`, looked up next to it in site-packages."""
+    base = Path(base_dir)
+    want = normalize_name(base.name)
+    try:
+        entries = os.listdir(str(base.parent))
+    except OSError:
+        return None
+    for name in sorted(entries):
+        if name.endswith('.dist-info') and normalize_name(name[:-len('.dist-info')].rsplit('-', 1)[0]) == want:
+            rec = base.parent / name / 'RECORD'
+            if rec.is_file():
+                return rec
+    return None
+
+def fingerprint(base_dir):
+    """Cheap change detector for an installed package: dist-info RECORD hash plus the
+    mtimes of the package dir and its top-level subdirectories."""
+    base = Path(base_dir)
+    h = hashlib.sha256()
+    rec = find_record(base)
+    if rec is not None:
+        try:
+            h.update(rec.read_bytes())
+        except OSError:
+            pass
+    try:
+        h.update(str(os.stat(str(base)).st_mtime_ns).encode())
+        with os.scandir(str(base)) as it:
+            for e in sorted(it, key=lambda e: e.name):
+                if e.is_dir(follow_symlinks=False):
+                    h.update(f'{e.name}:{e.stat(follow_symlinks=False).st_mtime_ns}'.encode())
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def get(kind, key, fp):
+    """Cached value for (kind, key) if it was stored with the same fingerprint, else None."""
+    p = _entry_path(kind, key)
+    try:
+        with open(p) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('fp') != fp:
+        return None
+    try:
+        os.utime(str(p))  # LRU: a hit makes the entry young again
+    except OSError:
+        pass
+    return data.get('value')
+
+def values(kind):
+    """(key, value) of every cached entry of `kind`, e.g. all packages scanned by env generate."""
+    try:
+        entries = [e.path for e in os.scandir(str(cache_dir()))
+                   if e.name.startswith(f'{kind}-') and e.name.endswith('.json')]
+    except OSError:
+        return []
+    out = []
+    for path in sorted(entries):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data.get('kind') == kind:
+            out.append((data.get('key'), data.get('value')))
+    return out
+
+def put(kind, key, fp, value):
+    p = _entry_path(kind, key)
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'kind': kind, 'key': key, 'fp': fp, 'value': value}, f)
+        os.replace(str(tmp), str(p))
+    except OSError:
+        return
+    _evict()
+
+def _evict():
+    try:
+        entries = [e for e in os.scandir(str(cache_dir())) if e.name.endswith('.json')]
+    except OSError:
+        return
+    extra = len(entries) - _max_entries()
+    if extra <= 0:
+        return
+    aged = []
+    for e in entries:
+        try:
+            aged.append((e.stat().st_mtime_ns, e.path))
+        except OSError:
+            extra -= 1  # already removed, e.g. by another process evicting
+    for _, path in sorted(aged)[:max(0, extra)]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def clear():
+    """Remove every cache entry; returns how many were removed."""
+    n = 0
+    try:
+        it = list(os.scandir(str(cache_dir())))
+    except OSError:
+        return 0
+    for e in it:
+        if e.name.endswith(('.json', '.tmp')):
+            try:
+                os.unlink(e.path)
+                n += 1
+            except OSError:
+                pass
+    return n
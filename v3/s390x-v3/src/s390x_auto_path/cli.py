@@ -1,14 +1,57 @@
 #!/usr/bin/env python3
 import argparse
-from . import libfix, envgen, validator
+import contextlib
+from . import __version__, output, profiling
 from pathlib import Path
+import os
 import sys
 
+# Subcommand modules are imported by their handlers (see _COMMANDS), so `--help` or
+# `scan` does not pay for zipfile, asyncio and friends. bench/startup.py tracks this.
+_LINK_MODES = ('symlink', 'hardlink', 'reflink')  # libfix.LINK_MODES
+
+def _parse_relocate(p, values):
+    relocate = []
+    for r in values:
+        old, sep, new = r.partition('=')
+        if not sep or not old:
+            p.error(f'--relocate expects OLD=NEW, got {r!r}')
+        relocate.append((old, new))
+    return relocate
+
+def _via_daemon(args, cmd, payload):
+    """Forward a request to a running daemon; returns its value, or None to run locally."""
+    if args.no_daemon:
+        return None
+    from . import daemon
+    info = daemon.handshake()
+    if info is None:
+        return None
+    if not info['compatible']:
+        print(f"[WARN] daemon (pid {info.get('pid')}) runs version {info.get('version')}, protocol "
+              f"{info.get('protocol')}; running locally (restart `s390x-auto-path serve`)")
+        return None
+    resp = daemon.request(cmd, payload)
+    if resp is None:
+        return None
+    print(resp['output'], end='')
+    if not resp['ok']:
+        print(f"[ERR] daemon: {resp['error']}")
+        sys.exit(1)
+    return resp['value']
+
 def main():
     p = argparse.ArgumentParser(prog='s390x-auto-path')
+    p.add_argument('--no-daemon', action='store_true', help='do not forward scan/env/validate to a running daemon')
+    p.add_argument('--format', choices=output.FORMATS, default='text',
+                   help='json: one document of typed records; ndjson: one record per line as produced. '
+                        'Human-readable lines then go to stderr')
+    p.add_argument('--profile', action='store_true', help='print per-phase wall time and I/O counters to stderr')
+    p.add_argument('--trace-json', metavar='FILE', help='write a Chrome trace-event file of all phases')
+    p.add_argument('--cprofile', metavar='FILE', help='dump cProfile stats (pstats format) to FILE')
     sub = p.add_subparsers(dest='cmd', required=True)
 
-    scan = sub.add_parser('scan', help='Scan installed packages (pip show pkg) and print paths')
+    scan = sub.add_parser('scan', help='Scan installed packages and print paths')
     scan.add_argument('packages', nargs='+')
 
     env = sub.add_parser('env', help='Environment helpers')
@@ -17,62 +60,190 @@ def main():
     env_gen.add_argument('out', help='output shell file to write (e.g. build_env.sh)')
     env_gen.add_argument('packages', nargs='+')
     env_gen.add_argument('--activate', action='store_true', help='print source command to stdout')
+    env_gen.add_argument('--no-cache', action='store_true', help='ignore and do not update the scan cache')
+    env_gen.add_argument('--lib-farm', metavar='DIR', help='symlink all libraries and .pc files into DIR and point '
+                                                          'LD_LIBRARY_PATH, LDFLAGS and PKG_CONFIG_PATH there')
 
     fix = sub.add_parser('fix', help='Fix installed package dirs or wheels')
-    fix.add_argument('targets', nargs='+')
-    fix.add_argument('--rewrite-cmake', action='store_true')
+    fix.add_argument('targets', nargs='+', help='package dirs, wheels, wheelhouse dirs or quoted globs')
+    fix.add_argument('--jobs', '-j', type=int, default=1, help='fix up to N targets in parallel processes (default: 1)')
+    fix.add_argument('--rewrite-cmake', action='store_true', help='rewrite lib paths to lib64 in .cmake and .pc files')
+    fix.add_argument('--relocate', action='append', default=[], metavar='OLD=NEW',
+                     help='with --rewrite-cmake, also replace prefix OLD by NEW (repeatable)')
+    fix.add_argument('--force', action='store_true', help='re-fix wheels the wheelhouse manifest already lists as fixed')
+    fix.add_argument('--link-mode', choices=_LINK_MODES, default='symlink',
+                     help='how lib/lib64 mirror entries are created in package dirs (default: symlink)')
+    fix.add_argument('--dry-run', action='store_true', help='print the layout plan without changing anything')
 
     validate = sub.add_parser('validate', help='Validate .so links')
     validate.add_argument('targets', nargs='+')
+    validate.add_argument('--no-cache', action='store_true', help='ignore and do not update the dependency cache')
+    validate.add_argument('--jobs', '-j', type=int, default=None, help='worker budget, split across targets then files (default: CPU count)')
+    validate.add_argument('--sysroot', default='', help='resolve system libraries under this root (e.g. an s390x image)')
+    validate.add_argument('--suggest', action='store_true',
+                          help='propose a provider and LD_LIBRARY_PATH/RUNPATH entry for each missing library')
 
     patch = sub.add_parser('patch-rpath', help='Patch rpath using patchelf')
     patch.add_argument('targets', nargs='+')
     patch.add_argument('--rpath', default='')
+    patch.add_argument('--jobs', '-j', type=int, default=None, help='worker budget, split across targets then files (default: CPU count)')
 
     inject = sub.add_parser('inject-sitecustomize', help='Inject sitecustomize into venv')
     inject.add_argument('venv')
+    inject.add_argument('--refresh', action='store_true', help='re-detect LIBDIR and rewrite an existing sitecustomize.py')
+
+    serve = sub.add_parser('serve', help='Run a daemon answering scan/env/validate over a Unix socket')
+    serve.add_argument('--socket', default=None, help='socket path (default: per interpreter, in $XDG_RUNTIME_DIR)')
+    serve.add_argument('--poll', type=float, default=2.0, help='seconds between site-packages change checks (default: 2)')
+
+    watch_p = sub.add_parser('watch', help='Re-fix packages as they are installed and keep build_env.sh current')
+    watch_p.add_argument('out', help='shell file to keep up to date (e.g. build_env.sh)')
+    watch_p.add_argument('packages', nargs='+')
+    watch_p.add_argument('--site-packages', default=None, help="directory to watch (default: this interpreter's site-packages)")
+    watch_p.add_argument('--rewrite-cmake', action='store_true', help='also rewrite lib paths in changed packages\' .cmake/.pc files')
+    watch_p.add_argument('--relocate', action='append', default=[], metavar='OLD=NEW',
+                         help='with --rewrite-cmake, also replace prefix OLD by NEW (repeatable)')
+    watch_p.add_argument('--poll', type=float, default=1.0, help='polling interval when inotify is unavailable (default: 1)')
+    watch_p.add_argument('--no-inotify', action='store_true', help='poll even where inotify is available')
+
+    cache_p = sub.add_parser('cache', help='Scan cache helpers')
+    cache_sub = cache_p.add_subparsers(dest='cache_cmd', required=True)
+    cache_sub.add_parser('clear', help='Remove all cached scan and dependency results')
 
     args = p.parse_args()
+    if args.profile or args.trace_json:
+        profiling.enable()
+        args.no_daemon = True  # measure the work in this process
+    if args.format != 'text':
+        output.configure(args.format, sys.stdout)
+        args.no_daemon = True  # records are produced in this process
+    prof = None
+    if args.cprofile:
+        import cProfile
+        prof = cProfile.Profile()
+    try:
+        if prof:
+            prof.enable()
+        with profiling.phase(args.cmd), \
+                (contextlib.redirect_stdout(sys.stderr) if output.structured() else contextlib.nullcontext()):
+            results = _dispatch(p, args)
+    finally:
+        output.finish()
+        if prof:
+            prof.disable()
+            prof.dump_stats(args.cprofile)
+        if args.profile:
+            profiling.print_summary(file=sys.stderr)
+        if args.trace_json:
+            profiling.write_trace(args.trace_json)
+    if results is not None:
+        from . import batch
+        with (contextlib.redirect_stdout(sys.stderr) if output.structured() else contextlib.nullcontext()):
+            failed = batch.print_summary(results) if len(results) > 1 else sum(1 for r in results if not r['ok'])
+        if failed:
+            sys.exit(1)
 
-    if args.cmd == 'scan':
-        for pkg in args.packages:
-            base = libfix.get_installed_package_path(pkg)
-            print(f"{pkg}: {base}")
-    elif args.cmd == 'env':
-        if args.env_cmd == 'generate':
-            combined = {'include': [], 'lib': [], 'lib64': [], 'pkgconfig': [], 'cmake': [], 'bin': []}
-            for pkg in args.packages:
-                base = libfix.get_installed_package_path(pkg)
-                if not base:
-                    print(f"[WARN] package not found: {pkg}")
-                    continue
-                # fix layout (create symlinks if necessary)
-                libfix.fix_lib_layout(base)
-                parts = libfix.find_subdirs(base)
-                for k,v in parts.items():
-                    combined[k].extend(v)
-            # additional deep cmake scan (handles aws-c-common layout)
-            extra = libfix.find_deep_cmake_dirs_from_packages([libfix.get_installed_package_path(p) for p in args.packages])
-            combined['cmake'].extend(extra)
-            # dedupe
-            for k in combined:
-                seen=set()
-                combined[k]=[x for x in combined[k] if x and not (x in seen or seen.add(x))]
+def _scan(p, args):
+    from . import resolver
+    resolved = _via_daemon(args, 'scan', {'packages': args.packages})
+    if resolved is None:
+        resolved = resolver.resolve_packages(args.packages)
+    for pkg in args.packages:
+        print(f"{pkg}: {resolved[pkg]}")
+        output.emit({'type': 'package', 'name': pkg, 'path': str(resolved[pkg]) if resolved[pkg] else None})
+
+def _env(p, args):
+    if args.env_cmd == 'generate':
+        out = os.path.abspath(args.out)
+        lib_farm = os.path.abspath(args.lib_farm) if args.lib_farm else None
+        if _via_daemon(args, 'env', {'out': out, 'packages': args.packages, 'use_cache': not args.no_cache,
+                                     'lib_farm': lib_farm}) is None:
+            from . import envgen
+            combined = envgen.collect_paths(args.packages, use_cache=not args.no_cache)
+            if lib_farm:
+                combined, _ = envgen.build_lib_farm(lib_farm, combined)
             env = envgen.build_env_flags(combined)
             envgen.write_shell(args.out, env)
-            if args.activate:
-                print(f"To activate, run: source {args.out}")
-    elif args.cmd == 'fix':
-        for t in args.targets:
-            libfix.fix_target(t, rewrite_cmake=args.rewrite_cmake)
-    elif args.cmd == 'validate':
-        for t in args.targets:
-            validator.run_validate(t)
-    elif args.cmd == 'patch-rpath':
-        for t in args.targets:
-            libfix.patch_rpath_target(t, args.rpath)
-    elif args.cmd == 'inject-sitecustomize':
-        libfix.inject_sitecustomize_into_venv(Path(args.venv))
-    else:
+        if args.activate:
+            print(f"To activate, run: source {args.out}")
+
+def _fix(p, args):
+    from . import batch, libfix, wheelhouse
+    relocate = _parse_relocate(p, args.relocate)
+    targets = wheelhouse.expand_targets(args.targets)
+    if not targets:
+        p.error('no targets matched')
+    options = {'rewrite_cmake': args.rewrite_cmake, 'relocate': [list(r) for r in relocate], 'version': __version__}
+    wheels = [t for t in targets if t.endswith('.whl')]
+    todo, skipped = wheelhouse.partition(wheels, options, force=args.force)
+    for w in skipped:
+        print(f'[OK] {w} already fixed, skipped')
+        output.emit({'type': 'skipped', 'target': w, 'reason': 'already fixed'})
+    skipped = set(skipped)
+    targets = [t for t in targets if t not in skipped]
+    procs, _ = batch.split_jobs(args.jobs, len(targets))
+    results = batch.run_targets(libfix.fix_target, targets, procs,
+                                rewrite_cmake=args.rewrite_cmake, relocate=relocate,
+                                link_mode=args.link_mode, dry_run=args.dry_run)
+    if not args.dry_run:
+        wheelhouse.update([r['target'] for r in results if r['ok'] and r['target'] in todo], options)
+    return results
+
+def _validate(p, args):
+    sysroot = os.path.abspath(args.sysroot).rstrip('/') if args.sysroot else ''
+    results = _via_daemon(args, 'validate', {'targets': [os.path.abspath(t) for t in args.targets],
+                                             'use_cache': not args.no_cache, 'jobs': args.jobs, 'sysroot': sysroot,
+                                             'ld_library_path': os.environ.get('LD_LIBRARY_PATH', ''),
+                                             'suggest': args.suggest})
+    if results is None:
+        from . import batch, soindex, validator
+        if args.suggest:
+            # build once here; pool workers then read it from the cache or inherit the memo
+            soindex.load(sysroot, use_cache=not args.no_cache)
+        procs, per_target = batch.split_jobs(args.jobs, len(args.targets))
+        results = batch.run_targets(validator.run_validate, args.targets, procs, use_cache=not args.no_cache,
+                                    jobs=per_target, sysroot=sysroot, suggest=args.suggest)
+    if len(args.targets) > 1:
+        total = sum(r['value'] or 0 for r in results)
+        print(f'[RESULT] {total} issues across {len(args.targets)} targets')
+    return results
+
+def _patch_rpath(p, args):
+    from . import batch, libfix
+    procs, per_target = batch.split_jobs(args.jobs, len(args.targets))
+    return batch.run_targets(libfix.patch_rpath_target, args.targets, procs, rpath=args.rpath, jobs=per_target)
+
+def _inject(p, args):
+    from . import libfix
+    libfix.inject_sitecustomize_into_venv(Path(args.venv), refresh=args.refresh)
+
+def _serve(p, args):
+    from . import daemon
+    try:
+        daemon.serve(args.socket, interval=args.poll)
+    except RuntimeError as e:
+        print(f'[ERR] {e}')
+        sys.exit(1)
+
+def _watch(p, args):
+    from . import watch
+    watch.watch(args.out, args.packages, site=args.site_packages, rewrite_cmake=args.rewrite_cmake,
+                relocate=_parse_relocate(p, args.relocate), interval=args.poll, use_inotify=not args.no_inotify)
+
+def _cache(p, args):
+    from . import cache
+    if args.cache_cmd == 'clear':
+        n = cache.clear()
+        print(f'[OK] removed {n} cache entries from {cache.cache_dir()}')
+        output.emit({'type': 'cache_clear', 'removed': n, 'dir': str(cache.cache_dir())})
+
+_COMMANDS = {'scan': _scan, 'env': _env, 'fix': _fix, 'validate': _validate, 'patch-rpath': _patch_rpath,
+             'inject-sitecustomize': _inject, 'serve': _serve, 'watch': _watch, 'cache': _cache}
+
+def _dispatch(p, args):
+    """Run the parsed subcommand; returns batch results for per-target commands, else None."""
+    handler = _COMMANDS.get(args.cmd)
+    if handler is None:
         p.print_help()
         sys.exit(1)
+    return handler(p, args)
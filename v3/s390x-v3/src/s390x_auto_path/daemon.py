@@ -0,0 +1,192 @@
+import contextlib
+import importlib
+import io
+import json
+import os
+import stat
+import sys
+import threading
+import zlib
+from . import __version__
+# socket, socketserver and the worker modules are imported where they are used: every
+# scan/env/validate CLI call imports this module just to find out whether a daemon runs
+
+# newline-delimited JSON, one request per connection:
+#   -> {"cmd": "scan" | "env" | "validate" | "ping" | "shutdown", "args": {...}}
+#   <- {"ok": bool, "value": ..., "output": "captured stdout", "error": "..."}
+PROTOCOL = 1
+
+def socket_path():
+    """Per-interpreter socket, so a daemon only serves clients of the same environment
+    (package resolution depends on sys.prefix). S390X_AUTO_PATH_SOCKET overrides it."""
+    env = os.environ.get('S390X_AUTO_PATH_SOCKET')
+    if env:
+        return env
+    tag = f'{zlib.crc32(os.fsencode(sys.prefix)):08x}'
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime and os.path.isdir(runtime):
+        d = runtime
+    else:
+        from . import cache
+        d = str(cache.cache_dir())
+    return os.path.join(d, f's390x-auto-path-{tag}.sock')
+
+def _site_dirs():
+    return sorted(set(os.path.abspath(p) for p in sys.path if p and os.path.isdir(p)))
+
+def _dir_mtimes(dirs):
+    out = {}
+    for d in dirs:
+        try:
+            out[d] = os.stat(d).st_mtime_ns
+        except OSError:
+            out[d] = None
+    return out
+
+def new_state():
+    """Warm in-memory state: resolved package dirs and per-package scans."""
+    return {'lock': threading.Lock(), 'resolved': {}, 'scans': {}, 'generation': 0}
+
+def invalidate(state):
+    with state['lock']:
+        state['resolved'].clear()
+        state['scans'].clear()
+        state['generation'] += 1
+    importlib.invalidate_caches()
+
+def _resolve(state, names):
+    from . import resolver
+    missing = [n for n in names if n not in state['resolved']]
+    if missing:
+        state['resolved'].update(resolver.resolve_packages(missing))
+    return {n: state['resolved'][n] for n in names}
+
+def _watch(state, stop, interval):
+    """Poll site-packages dir mtimes; installs and removals touch them."""
+    dirs = _site_dirs()
+    last = _dir_mtimes(dirs)
+    while not stop.wait(interval):
+        now = _dir_mtimes(dirs)
+        if now != last:
+            last = now
+            invalidate(state)
+
+def _handle(state, cmd, args):
+    from . import batch, envgen, validator
+    if cmd == 'shutdown':
+        return None
+    if cmd == 'ping':
+        return {'version': __version__, 'protocol': PROTOCOL, 'pid': os.getpid(), 'generation': state['generation']}
+    if cmd == 'scan':
+        return {n: str(p) if p else None for n, p in _resolve(state, args['packages']).items()}
+    if cmd == 'env':
+        use_cache = args.get('use_cache', True)
+        combined = envgen.collect_paths(args['packages'], resolved=_resolve(state, args['packages']),
+                                        use_cache=use_cache, memo=state['scans'] if use_cache else None)
+        if args.get('lib_farm'):
+            combined, _ = envgen.build_lib_farm(args['lib_farm'], combined)
+        env = envgen.build_env_flags(combined)
+        envgen.write_shell(args['out'], env)
+        return env
+    if cmd == 'validate':
+        kwargs = {'use_cache': args.get('use_cache', True), 'jobs': args.get('jobs'),
+                  'sysroot': args.get('sysroot', ''), 'ld_library_path': args.get('ld_library_path'),
+                  'suggest': args.get('suggest', False)}
+        results = []
+        for t in args['targets']:
+            r = batch.run_one(validator.run_validate, t, kwargs, capture=True)
+            print(r['output'], end='')
+            if not r['ok']:
+                print(f"[ERR] {t}: {r['error']}")
+            r['output'] = ''
+            results.append(r)
+        return results
+    raise ValueError(f'unknown command: {cmd!r}')
+
+def _serve_one(handler):
+    """socketserver handle(): one request line in, one response line out."""
+    buf = io.StringIO()
+    try:
+        req = json.loads(handler.rfile.readline().decode('utf-8'))
+        with handler.server.state['lock'], contextlib.redirect_stdout(buf):
+            value = _handle(handler.server.state, req.get('cmd'), req.get('args') or {})
+        resp = {'ok': True, 'value': value, 'output': buf.getvalue(), 'error': ''}
+        if req.get('cmd') == 'shutdown':
+            threading.Thread(target=handler.server.shutdown, daemon=True).start()
+    except Exception as e:
+        resp = {'ok': False, 'value': None, 'output': buf.getvalue(), 'error': f'{type(e).__name__}: {e}'}
+    handler.wfile.write(json.dumps(resp).encode('utf-8') + b'\n')
+
+def serve(path=None, interval=2.0):
+    """Run the daemon in the foreground until a `shutdown` request or Ctrl-C."""
+    path = path or socket_path()
+    if request('ping', path=path, timeout=2) is not None:
+        raise RuntimeError(f'a daemon is already listening on {path}')
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        mode = None
+    if mode is not None:
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError(f'{path} exists and is not a socket')
+        os.unlink(path)  # stale socket from a daemon that died
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    state = new_state()
+    stop = threading.Event()
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        handle = _serve_one
+
+    umask = os.umask(0o077)  # the socket is created owner-only, no window before a chmod
+    try:
+        server = socketserver.UnixStreamServer(path, Handler)
+    finally:
+        os.umask(umask)
+    server.state = state
+    watcher = threading.Thread(target=_watch, args=(state, stop, interval), daemon=True)
+    watcher.start()
+    print(f'[OK] serving on {path} (pid {os.getpid()})', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+def request(cmd, args=None, path=None, timeout=None):
+    """Send one request to the daemon. Returns the response dict, or None when no
+    daemon is listening (callers then do the work in-process)."""
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    import socket
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps({'cmd': cmd, 'args': args or {}}).encode('utf-8') + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        data = b''.join(iter(lambda: s.recv(65536), b''))
+    except OSError:
+        return None
+    finally:
+        s.close()
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+def handshake(path=None, timeout=None):
+    """Ping the daemon before sending it work. Returns None when no daemon answers, else
+    its ping value with `compatible` set when it runs this version and protocol (a daemon
+    started before an upgrade would serve the old code and drop new request fields)."""
+    resp = request('ping', path=path, timeout=timeout)
+    if not resp or not resp.get('ok') or not isinstance(resp.get('value'), dict):
+        return None
+    info = resp['value']
+    info['compatible'] = info.get('version') == __version__ and info.get('protocol') == PROTOCOL
+    return info
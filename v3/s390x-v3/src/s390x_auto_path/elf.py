@@ -0,0 +1,373 @@
+import glob
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+EM_S390 = 22
+SHT_DYNSYM, SHT_GNU_VERDEF, SHT_GNU_VERNEED = 11, 0x6ffffffd, 0x6ffffffe
+PT_LOAD, PT_DYNAMIC, PT_INTERP = 1, 2, 3
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_STRSZ, DT_SONAME, DT_RPATH, DT_RUNPATH = 0, 1, 5, 10, 14, 15, 29
+
+# program interpreter per (e_machine, class), for shared objects that carry no PT_INTERP
+DEFAULT_INTERP = {
+    (EM_S390, 64): '/lib/ld64.so.1',
+    (EM_S390, 32): '/lib/ld.so.1',
+    (62, 64): '/lib64/ld-linux-x86-64.so.2',
+    (3, 32): '/lib/ld-linux.so.2',
+    (21, 64): '/lib64/ld64.so.2',
+    (183, 64): '/lib/ld-linux-aarch64.so.1',
+}
+
+class ElfError(ValueError):
+    pass
+
+class ElfTruncated(ElfError):
+    """The buffer ends before the headers/dynamic data it points at."""
+
+def _cstr(buf, off):
+    end = buf.find(b'\0', off)
+    if end < 0:
+        raise ElfTruncated('unterminated string in .dynstr')
+    return bytes(buf[off:end]).decode('utf-8', 'surrogateescape')
+
+def parse_dynamic(buf):
+    """Read class, byte order, machine and the dynamic section of an ELF image.
+
+    `buf` is any bytes-like object (bytes, mmap). Returns a dict with `class` (32/64),
+    `endian` ('<'/'>'), `machine` (e_machine, EM_S390 on s390x), `needed`, `soname`,
+    `rpath`, `runpath`, `interp`, `dynamic` and `dynstr` (file offset/size of the dynamic
+    section and of its string table)."""
+    if bytes(buf[:4]) != b'\x7fELF':
+        raise ElfError('not an ELF file')
+    if len(buf) < 64:
+        raise ElfTruncated('truncated ELF header')
+    cls, data = buf[4], buf[5]
+    if cls not in (1, 2) or data not in (1, 2):
+        raise ElfError('bad ELF identification')
+    e = '<' if data == 1 else '>'
+    is64 = cls == 2
+    try:
+        if is64:
+            _, machine, _, _, phoff, _, _, _, phentsize, phnum = struct.unpack_from(e + 'HHIQQQIHHH', buf, 16)
+        else:
+            _, machine, _, _, phoff, _, _, _, phentsize, phnum = struct.unpack_from(e + 'HHIIIIIHHH', buf, 16)
+        loads, dyn, interp = [], None, None
+        for i in range(phnum):
+            off = phoff + i * phentsize
+            if is64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = struct.unpack_from(e + 'IIQQQQQQ', buf, off)
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = struct.unpack_from(e + 'IIIIIIII', buf, off)
+            if p_type == PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == PT_DYNAMIC:
+                dyn = (p_offset, p_filesz)
+            elif p_type == PT_INTERP:
+                interp = _cstr(buf, p_offset)
+    except struct.error:
+        raise ElfTruncated('truncated ELF headers')
+    info = {'class': 64 if is64 else 32, 'endian': e, 'machine': machine, 'needed': [],
+            'soname': None, 'rpath': None, 'runpath': None, 'interp': interp, 'dynstr': None,
+            'dynamic': dyn}
+    if dyn is None:
+        return info  # static object
+    entries = []
+    fmt, size = (e + 'qQ', 16) if is64 else (e + 'iI', 8)
+    for off in range(dyn[0], dyn[0] + dyn[1] - size + 1, size):
+        try:
+            tag, val = struct.unpack_from(fmt, buf, off)
+        except struct.error:
+            raise ElfTruncated('truncated dynamic section')
+        if tag == DT_NULL:
+            break
+        entries.append((tag, val))
+    tags = dict(entries)
+    if DT_STRTAB not in tags:
+        return info
+    strtab = None
+    for vaddr, offset, filesz in loads:
+        if vaddr <= tags[DT_STRTAB] < vaddr + filesz:
+            strtab = tags[DT_STRTAB] - vaddr + offset
+            break
+    if strtab is None:
+        raise ElfError('DT_STRTAB outside loadable segments')
+    info['dynstr'] = (strtab, tags.get(DT_STRSZ, 0))
+    for tag, val in entries:
+        if tag == DT_NEEDED:
+            info['needed'].append(_cstr(buf, strtab + val))
+        elif tag == DT_SONAME:
+            info['soname'] = _cstr(buf, strtab + val)
+        elif tag == DT_RPATH:
+            info['rpath'] = _cstr(buf, strtab + val)
+        elif tag == DT_RUNPATH:
+            info['runpath'] = _cstr(buf, strtab + val)
+    return info
+
+def read_ident(path):
+    """(class, machine) from the first bytes of the ELF header, or None for non-ELF files
+    (linker scripts, data). Much cheaper than read_dynamic for bulk directory indexing."""
+    with open(path, 'rb') as f:
+        head = f.read(20)
+    if len(head) < 20 or head[:4] != b'\x7fELF' or head[4] not in (1, 2) or head[5] not in (1, 2):
+        return None
+    return (32 if head[4] == 1 else 64), struct.unpack_from('<H' if head[5] == 1 else '>H', head, 18)[0]
+
+def parse_stream(f, chunk=1 << 16):
+    """parse_dynamic over a sequential stream (e.g. a zip member), reading only as far
+    into it as the headers and dynamic string table require."""
+    buf = bytearray()
+    while True:
+        data = f.read(max(chunk, len(buf)))
+        buf += data
+        try:
+            return parse_dynamic(buf)
+        except ElfTruncated:
+            if not data:
+                raise ElfError('truncated ELF file')
+
+def read_dynamic(path):
+    with open(path, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ElfError('empty file')
+        with m:
+            return parse_dynamic(m)
+
+def _dyn_entries(buf, info):
+    e = info['endian']
+    fmt, size = (e + 'qQ', 16) if info['class'] == 64 else (e + 'iI', 8)
+    off, total = info['dynamic']
+    out = []
+    for pos in range(off, off + total - size + 1, size):
+        tag, val = struct.unpack_from(fmt, buf, pos)
+        if tag == DT_NULL:
+            break
+        out.append((tag, val, pos))
+    return out
+
+def _referenced_strings(buf, info, entries):
+    """.dynstr offsets used by the dynamic section, .dynsym, .gnu.version_d and
+    .gnu.version_r, or None without section headers (e.g. sstrip'd objects)."""
+    e, is64 = info['endian'], info['class'] == 64
+    refs = set(val for tag, val, _ in entries if tag in (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH))
+    if is64:
+        shoff, = struct.unpack_from(e + 'Q', buf, 40)
+        shentsize, shnum = struct.unpack_from(e + 'HH', buf, 58)
+        shfmt = e + 'IIQQQQIIQQ'
+    else:
+        shoff, = struct.unpack_from(e + 'I', buf, 32)
+        shentsize, shnum = struct.unpack_from(e + 'HH', buf, 46)
+        shfmt = e + 'IIIIIIIIII'
+    if not shoff or not shnum:
+        return None
+    for i in range(shnum):
+        _, sh_type, _, _, sh_offset, sh_size, _, sh_info, _, sh_entsize = struct.unpack_from(shfmt, buf, shoff + i * shentsize)
+        if sh_type == SHT_DYNSYM and sh_entsize:
+            for pos in range(sh_offset, sh_offset + sh_size, sh_entsize):
+                refs.add(struct.unpack_from(e + 'I', buf, pos)[0])
+        elif sh_type == SHT_GNU_VERNEED:
+            pos = sh_offset
+            for _ in range(sh_info):
+                _, cnt, vn_file, vn_aux, vn_next = struct.unpack_from(e + 'HHIII', buf, pos)
+                refs.add(vn_file)
+                aux = pos + vn_aux
+                for _ in range(cnt):
+                    _, _, _, vna_name, vna_next = struct.unpack_from(e + 'IHHII', buf, aux)
+                    refs.add(vna_name)
+                    aux += vna_next
+                if not vn_next:
+                    break
+                pos += vn_next
+        elif sh_type == SHT_GNU_VERDEF:
+            pos = sh_offset
+            for _ in range(sh_info):
+                _, _, _, cnt, _, vd_aux, vd_next = struct.unpack_from(e + 'HHHHIII', buf, pos)
+                aux = pos + vd_aux
+                for _ in range(cnt):
+                    vda_name, vda_next = struct.unpack_from(e + 'II', buf, aux)
+                    refs.add(vda_name)
+                    aux += vda_next
+                if not vd_next:
+                    break
+                pos += vd_next
+    return refs
+
+def set_runpath_inplace(path, rpath):
+    """Rewrite DT_RUNPATH/DT_RPATH of `path` in place when `rpath` fits in the existing
+    .dynstr slot. Like `patchelf --set-rpath`, a DT_RPATH entry becomes DT_RUNPATH.
+
+    Returns False (file untouched) when there is no rpath entry to reuse, the new value is
+    longer than the old one, another string is tail-merged into the slot or there are no
+    section headers to find the symbol and version names by; the caller
+    then needs a tool that can grow .dynstr (patchelf)."""
+    new = rpath.encode('utf-8')
+    with open(path, 'r+b') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0)
+        except ValueError:
+            raise ElfError('empty file')
+        with m:
+            info = parse_dynamic(m)
+            if info['dynstr'] is None:
+                return False
+            strtab = info['dynstr'][0]
+            try:
+                entries = _dyn_entries(m, info)
+                # with a RUNPATH present ld.so ignores RPATH, so only RUNPATH needs the new value
+                slots = [x for x in entries if x[0] == DT_RUNPATH] or [x for x in entries if x[0] == DT_RPATH]
+                if not slots:
+                    return False
+                refs = _referenced_strings(m, info, entries)
+            except struct.error:
+                raise ElfError('truncated ELF file')
+            if refs is None:
+                return False  # symbol and version names sharing the slot cannot be ruled out
+            edits = []
+            for tag, val, pos in slots:
+                old = m.find(b'\0', strtab + val) - (strtab + val)
+                shared = any(val < r < val + old for r in refs)
+                if len(new) > old or shared:
+                    return False
+                edits.append((val, old, pos))
+            e = info['endian']
+            fmt = e + 'q' if info['class'] == 64 else e + 'i'
+            for val, old, pos in edits:
+                m[strtab + val:strtab + val + old + 1] = new + b'\0' * (old + 1 - len(new))
+                struct.pack_into(fmt, m, pos, DT_RUNPATH)
+            m.flush()
+    return True
+
+@lru_cache(maxsize=4096)
+def _read_stamped(path, mtime_ns, size):
+    try:
+        return read_dynamic(path)
+    except (OSError, ElfError):
+        return None
+
+def read_cached(path):
+    """read_dynamic(path) memoized per process, or None for a missing or non-ELF file.
+    Keyed on mtime/size so long-lived processes notice replaced libraries."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _read_stamped(path, st.st_mtime_ns, st.st_size)
+
+def _parse_ld_so_conf(path, sysroot, seen):
+    dirs = []
+    if path in seen:
+        return dirs
+    seen.add(path)
+    try:
+        with open(sysroot + path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return dirs
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('include '):
+            pat = line.split(None, 1)[1]
+            if not pat.startswith('/'):
+                pat = os.path.join(os.path.dirname(path), pat)
+            for inc in sorted(glob.glob(sysroot + pat)):
+                dirs.extend(_parse_ld_so_conf(inc[len(sysroot):], sysroot, seen))
+        elif line.startswith('/'):
+            dirs.append(line)
+    return dirs
+
+@lru_cache(maxsize=None)
+def system_dirs(sysroot='', elf_class=64):
+    """ld.so.conf entries followed by the loader's trusted default dirs."""
+    dirs = _parse_ld_so_conf('/etc/ld.so.conf', sysroot, set())
+    default = ['/lib64', '/usr/lib64'] if elf_class == 64 else []
+    out = []
+    for d in dirs + default + ['/lib', '/usr/lib']:
+        if d not in out:
+            out.append(d)
+    return tuple(sysroot + d for d in out)
+
+def _expand(paths, origin, elf_class):
+    out = []
+    for d in (paths or '').split(':'):
+        if not d:
+            continue
+        d = d.replace('$ORIGIN', origin).replace('${ORIGIN}', origin)
+        d = d.replace('$LIB', 'lib64' if elf_class == 64 else 'lib').replace('${LIB}', 'lib64' if elf_class == 64 else 'lib')
+        out.append(d)
+    return out
+
+def _compatible(path, ref):
+    info = read_cached(path)
+    return info is not None and info['class'] == ref['class'] and info['machine'] == ref['machine']
+
+def _find(name, dirs, ref, overlay):
+    for d in dirs:
+        cand = os.path.join(d, name)
+        if overlay:
+            info = overlay.get(os.path.normpath(cand))
+            if info is not None:
+                if info['class'] == ref['class'] and info['machine'] == ref['machine']:
+                    return cand
+                continue
+        if os.path.isfile(cand) and _compatible(cand, ref):
+            return cand
+    return None
+
+def lookup(path, overlay):
+    """The parsed ELF info of `path`: from `overlay` ({normpath: info}) when it has the
+    path, else read_cached()."""
+    if overlay:
+        key = os.path.normpath(path)
+        if key in overlay:
+            return overlay[key]
+    return read_cached(path)
+
+def resolve_deps(path, sysroot='', ld_library_path=None, overlay=None):
+    """Resolve DT_NEEDED of `path` and of everything it pulls in, the way ld.so does.
+
+    Per object the order is DT_RPATH (with the loader chain's RPATHs, only when the object
+    has no DT_RUNPATH), LD_LIBRARY_PATH, DT_RUNPATH, then ld.so.conf and default dirs.
+    Each soname is loaded once, breadth-first. Candidates of another ELF class or machine
+    are skipped. The program interpreter counts as already loaded and, like in ldd's `=>`
+    lines, is not reported. `overlay` maps extra (virtual) paths to parsed infos, e.g. the
+    members of a wheel that is inspected without extracting it.
+    Returns [(soname, path or None)] in load order."""
+    root = overlay.get(path) if overlay and path in overlay else read_dynamic(path)
+    if ld_library_path is None:
+        ld_library_path = os.environ.get('LD_LIBRARY_PATH', '')
+    sysdirs = system_dirs(sysroot, root['class'])
+    env_dirs = _expand(ld_library_path, '', root['class'])
+    loaded, order = {}, []
+    interp = root['interp'] or DEFAULT_INTERP.get((root['machine'], root['class']))
+    if interp:
+        loaded[os.path.basename(interp)] = sysroot + interp
+    if root['soname']:
+        loaded[root['soname']] = path
+    queue = [(path, root, [])]
+    while queue:
+        obj, info, chain_rpaths = queue.pop(0)
+        origin = os.path.dirname(os.path.abspath(obj))
+        own_rpath = _expand(info['rpath'], origin, info['class'])
+        if info['runpath'] is not None:
+            rpaths = []
+        else:
+            rpaths = own_rpath + chain_rpaths
+        runpath = _expand(info['runpath'], origin, info['class'])
+        for name in info['needed']:
+            if name in loaded:
+                continue
+            if '/' in name:
+                found = name if os.path.isfile(name) else None
+            else:
+                found = _find(name, rpaths + env_dirs + runpath + list(sysdirs), root, overlay)
+            loaded[name] = found
+            order.append((name, found))
+            if found:
+                sub = lookup(found, overlay)
+                if sub is not None:
+                    queue.append((found, sub, own_rpath + chain_rpaths))
+    return order
@@ -1,5 +1,273 @@
+import json
+import os
 import shlex
-def build_env_flags(all_paths):
+from . import cache, fsindex, libfix, output, profiling, resolver
+
+@profiling.phase('scan_package')
+def scan_package(base, rewrite_cmake=False, relocate=(), index=None):
+    """Fix one package dir and scan it; returns {'parts': find_subdirs(), 'cmake': deep dirs}.
+    `index` is a current fsindex of `base` to use (and extend) instead of walking it."""
+    # one tree walk per package, shared by the layout fix and both scans
+    if index is None:
+        index = fsindex.index_tree(base)
+    # fix layout (create symlinks if necessary)
+    libfix.fix_lib_layout(base, index=index)
+    if rewrite_cmake:
+        libfix.rewrite_cmake_paths(base, relocate=relocate, index=index)
+    # additional deep cmake scan (handles aws-c-common layout)
+    return {'parts': libfix.find_subdirs(base, index=index),
+            'cmake': libfix.find_deep_cmake_dirs_from_packages([base], indexes={str(base): index})}
+
+def cached_scan(base, use_cache=True, memo=None, indexes=None):
+    """scan_package() through the scan cache. `memo` is an optional in-memory
+    {base: (fingerprint, scan)} dict consulted before the disk cache, as kept by the daemon
+    and api.Session; it is used even when `use_cache` turns the disk cache off.
+    `indexes` is an optional {base: (fingerprint, fsindex)} dict of held trees: a current
+    one is scanned instead of walking the package again, and the result is stored back."""
+    fp = cache.fingerprint(base) if use_cache or memo is not None or indexes is not None else None
+    hit = None
+    if fp and memo is not None and memo.get(str(base), (None,))[0] == fp:
+        hit = memo[str(base)][1]
+    if hit is None and fp and use_cache:
+        hit = cache.get('env', str(base), fp)
+    if hit is None:
+        held = indexes.get(str(base)) if indexes is not None else None
+        index = held[1] if held and fp and held[0] == fp else fsindex.index_tree(base)
+        hit = scan_package(base, index=index)
+        # fingerprint after fixing: new compat links change lib/lib64 mtimes
+        fp = cache.fingerprint(base) if fp is not None else None
+        if fp and use_cache:
+            cache.put('env', str(base), fp, hit)
+        if fp and indexes is not None:
+            indexes[str(base)] = (fp, index)
+    if fp and memo is not None:
+        memo[str(base)] = (fp, hit)
+    return hit
+
+def merge_scans(scans):
+    """Merge per-package scans in order, deep cmake dirs last, deduplicated. 'libdirs'
+    holds the lib and lib64 dirs package by package, for minimal_paths()."""
+    combined = {'include': [], 'lib': [], 'lib64': [], 'pkgconfig': [], 'cmake': [], 'bin': [], 'libdirs': []}
+    deep = []
+    for hit in scans:
+        for k,v in hit['parts'].items():
+            combined[k].extend(v)
+        combined['libdirs'].extend(_package_order(hit['parts'].get('lib64', []), hit['parts'].get('lib', [])))
+        deep.extend(hit['cmake'])
+    combined['cmake'].extend(deep)
+    # dedupe
+    for k in combined:
+        seen=set()
+        combined[k]=[x for x in combined[k] if x and not (x in seen or seen.add(x))]
+    return combined
+
+def collect_paths(packages, resolved=None, use_cache=True, memo=None, indexes=None):
+    """Fix and scan every package and merge the discovered paths (see cached_scan).
+    `resolved` is a {name: Path or None} map, looked up when omitted."""
+    if resolved is None:
+        resolved = resolver.resolve_packages(packages)
+    scans = []
+    for pkg in packages:
+        base = resolved.get(pkg)
+        if not base:
+            print(f"[WARN] package not found: {pkg}")
+            continue
+        scans.append(cached_scan(base, use_cache, memo, indexes))
+    return merge_scans(scans)
+
+def _entries(d):
+    try:
+        with os.scandir(d) as it:
+            return list(it)
+    except OSError:
+        return []
+
+def _is_cmake_config(name):
+    name = name.lower()
+    return name.endswith('config.cmake') and name != 'config.cmake'
+
+def _has_cmake_config(d):
+    """CMake finds <name>Config.cmake / <name>-config.cmake in the dir or one level below."""
+    for e in _entries(d):
+        if e.is_file() and _is_cmake_config(e.name):
+            return True
+        if e.is_dir() and any(f.is_file() and _is_cmake_config(f.name) for f in _entries(e.path)):
+            return True
+    return False
+
+def _has_aws_modules(d):
+    """The Aws*.cmake modules (AwsCFlags.cmake, AwsFindPackage.cmake, ...) that aws-c-*
+    builds include from CMAKE_PREFIX_PATH / CMAKE_MODULE_PATH."""
+    return any(e.is_file() and e.name.startswith('Aws') and e.name.endswith('.cmake') for e in _entries(d))
+
+def _dedupe_real(paths):
+    seen, out = set(), []
+    for p in paths:
+        real = os.path.realpath(p)
+        if real not in seen:
+            seen.add(real)
+            out.append(p)
+    return out
+
+def _package_order(lib64, lib):
+    """lib and lib64 dirs grouped by parent dir, lib64 first within a group. Both lists are
+    in package order; where they do not say which of two groups comes first, lib dirs keep
+    their lead, as in the unreduced lib + lib64 order."""
+    order = []
+    for seq in (lib64, lib):
+        pos = 0
+        for d in seq:
+            parent = os.path.dirname(d.rstrip(os.sep))
+            if parent in order:
+                pos = order.index(parent) + 1
+            else:
+                order.insert(pos, parent)
+                pos += 1
+    groups = {parent: [] for parent in order}
+    for d in lib64 + lib:
+        groups[os.path.dirname(d.rstrip(os.sep))].append(d)
+    return [d for parent in order for d in groups[parent]]
+
+def _lib_dirs(paths):
+    """Dirs that hold libraries, in the given order. A dir whose libraries all resolve to
+    files already provided by an earlier dir (the per-file lib/lib64 compat links) is
+    dropped. Static archives count too, since -L serves them as well."""
+    provided, out = set(), []
+    for d in _dedupe_real(paths):
+        libs = set(os.path.realpath(e.path) for e in _entries(d) if fsindex.is_so(e.name) or e.name.endswith('.a'))
+        if libs and not libs <= provided:
+            provided |= libs
+            out.append(d)
+    return out
+
+def minimal_paths(all_paths):
+    """The smallest path set with the same lookups: include roots only (a subdir of another
+    include dir adds nothing for <dir/header.h> includes), dirs deduplicated by realpath,
+    lib dirs only if they hold .so (or .a) files (all under 'lib64', package by package),
+    pkgconfig dirs only with .pc files and cmake dirs only with a *Config.cmake /
+    *-config.cmake (directly or one level down) or Aws*.cmake modules."""
+    includes = _dedupe_real(all_paths.get('include', []) or [])
+    roots = [d for d in includes
+             if not any(d != r and d.startswith(r.rstrip(os.sep) + os.sep) for r in includes)]
+    lib64 = all_paths.get('lib64', []) or []
+    lib = all_paths.get('lib', []) or []
+    libdirs = all_paths.get('libdirs') or _package_order(lib64, lib)
+    return {
+        'include': roots,
+        'lib64': _lib_dirs(libdirs),
+        'lib': [],
+        'pkgconfig': [d for d in _dedupe_real(all_paths.get('pkgconfig', []) or [])
+                      if any(e.name.endswith('.pc') for e in _entries(d))],
+        'cmake': [d for d in _dedupe_real(all_paths.get('cmake', []) or [])
+                  if _has_cmake_config(d) or _has_aws_modules(d)],
+        'bin': _dedupe_real(all_paths.get('bin', []) or []),
+    }
+
+def _farm_link(target, link):
+    """Point `link` at `target`; returns False when it already does or `link` is not a
+    symlink (a file someone put there is left alone)."""
+    if os.path.lexists(link) and not os.path.islink(link):
+        print(f"[WARN] {link} is not a symlink, leaving it alone")
+        return False
+    try:
+        if os.readlink(link) == target:
+            return False
+    except OSError:
+        pass
+    tmp = f'{link}.{os.getpid()}.tmp'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)  # left behind by a run that crashed
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+    return True
+
+def _uses_pcfiledir(pc):
+    try:
+        with open(pc, 'rb') as f:
+            return b'pcfiledir' in f.read()
+    except OSError:
+        return True
+
+# names of the links build_lib_farm made, so a later run removes only its own
+FARM_MANIFEST = '.s390x-auto-path-farm.json'
+
+def _read_manifest(farm):
+    try:
+        with open(os.path.join(farm, FARM_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def build_lib_farm(farm_dir, all_paths):
+    """Symlink every library of the (minimal) lib dirs into `farm_dir` and every .pc file into
+    `farm_dir/pkgconfig`, so one directory replaces the per-package search path entries.
+
+    The first dir in search order wins a duplicate file name, as it would for the loader;
+    a duplicate that resolves to a different file is reported as a conflict. .pc files that
+    use ${pcfiledir} would resolve it to the farm, so their dirs are kept as they are.
+    Links an earlier run made (recorded in FARM_MANIFEST) that are no longer wanted are
+    removed; other files and links in `farm_dir` are left alone.
+    Returns (paths for build_env_flags, stats with linked/conflicts)."""
+    paths = minimal_paths(all_paths)
+    farm = os.path.abspath(str(farm_dir))
+    pcdir = os.path.join(farm, 'pkgconfig')
+    os.makedirs(pcdir, exist_ok=True)
+    wanted = {farm: {}, pcdir: {}}
+    conflicts = {}
+
+    def offer(dest, src):
+        name = os.path.basename(src)
+        have = wanted[dest].get(name)
+        if have is None:
+            wanted[dest][name] = src
+        elif os.path.realpath(have) != os.path.realpath(src):
+            conflicts.setdefault(name, {'name': name, 'used': have, 'ignored': []})['ignored'].append(src)
+
+    for d in paths['lib64'] + paths['lib']:
+        for e in sorted(_entries(d), key=lambda e: e.name):
+            if fsindex.is_so(e.name) or e.name.endswith('.a'):
+                offer(farm, os.path.abspath(e.path))
+    kept_pc = []
+    for d in paths['pkgconfig']:
+        pcs = sorted(e.path for e in _entries(d) if e.name.endswith('.pc'))
+        if any(_uses_pcfiledir(pc) for pc in pcs):
+            kept_pc.append(d)
+            continue
+        for pc in pcs:
+            offer(pcdir, os.path.abspath(pc))
+    changed = 0
+    owned = _read_manifest(farm)
+    for dest, links in wanted.items():
+        rel = os.path.relpath(dest, farm)
+        for name in owned.get(rel, []):
+            path = os.path.join(dest, name)
+            if name not in links and os.path.islink(path):
+                os.unlink(path)
+        for name, src in links.items():
+            changed += _farm_link(src, os.path.join(dest, name))
+    manifest = {os.path.relpath(dest, farm): sorted(links) for dest, links in wanted.items()}
+    tmp = os.path.join(farm, f'{FARM_MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(farm, FARM_MANIFEST))
+    for c in conflicts.values():
+        print(f"[WARN] {c['name']}: using {c['used']}, ignoring {', '.join(c['ignored'])}")
+    stats = {'dir': farm, 'libs': len(wanted[farm]), 'pc': len(wanted[pcdir]), 'changed': changed,
+             'conflicts': list(conflicts.values())}
+    print(f"[OK] lib farm {farm}: {stats['libs']} libraries, {stats['pc']} .pc files, "
+          f"{len(conflicts)} conflicts")
+    output.emit(dict({'type': 'lib_farm'}, **stats))
+    out = dict(paths)
+    out['lib64'] = [farm] if wanted[farm] else []
+    out['lib'] = []
+    out['pkgconfig'] = ([pcdir] if wanted[pcdir] else []) + kept_pc
+    return out, stats
+
+def build_env_flags(all_paths, minimal=True):
+    """Shell variables for the scanned paths; `minimal` first reduces them with minimal_paths()
+    so compilers and the loader probe as few directories as possible."""
+    if minimal:
+        all_paths = minimal_paths(all_paths)
     include_paths = all_paths.get('include', [])
     lib_paths = (all_paths.get('lib', []) or []) + (all_paths.get('lib64', []) or [])
     pkgconfig_paths = all_paths.get('pkgconfig', [])
@@ -18,6 +286,7 @@ def build_env_flags(all_paths):
         env['CMAKE_PREFIX_PATH'] = ':'.join(cmake_paths)
     return env
 
+@profiling.phase('write_shell')
 def write_shell(path, env):
     lines = []
     lines.append('#!/usr/bin/env bash')
@@ -30,3 +299,4 @@ def write_shell(path, env):
     with open(path,'w') as f:
         f.write('\n'.join(lines))
     print(f'[OK] wrote environment to {path}')
+    output.emit({'type': 'env', 'out': str(path), 'vars': env})
@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+from . import profiling
+
+def is_so(name):
+    return '.so' in name and (name.endswith('.so') or '.so.' in name)
+
+@profiling.phase('index_tree')
+def index_tree(base_dir):
+    """Walk `base_dir` once with os.scandir and record everything the layout helpers query
+    (dirs, shared objects, .cmake and .pc files, pkgconfig dirs).
+
+    Paths are stored relative to the base, dirs in the same order os.walk would yield them.
+    Symlinked dirs are listed but not descended into (os.walk semantics)."""
+    base = Path(base_dir)
+    idx = {'base': base, 'dirs': [], 'dirset': set(), 'so': [], 'cmake': [], 'pc': [], 'pkgconfig': []}
+    if not base.is_dir():
+        return idx
+    stack = ['']
+    visited = 0
+    while stack:
+        rel = stack.pop()
+        try:
+            it = os.scandir(os.path.join(str(base), rel) if rel else str(base))
+        except OSError:
+            continue
+        subdirs = []
+        with it:
+            for e in it:
+                visited += 1
+                path = os.path.join(rel, e.name) if rel else e.name
+                try:
+                    is_dir = e.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    idx['dirs'].append(path)
+                    if e.name == 'pkgconfig':
+                        idx['pkgconfig'].append(path)
+                    if not e.is_symlink():
+                        subdirs.append(path)
+                    continue
+                if is_so(e.name):
+                    idx['so'].append(path)
+                elif e.name.endswith('.cmake'):
+                    idx['cmake'].append(path)
+                elif e.name.endswith('.pc'):
+                    idx['pc'].append(path)
+        stack.extend(reversed(subdirs))
+    idx['dirset'].update(idx['dirs'])
+    profiling.count('files_visited', visited)
+    return idx
+
+def add_entry(idx, rel, is_dir=False):
+    """Record a path created after indexing (e.g. a compat symlink) so later queries see it."""
+    rel = str(rel)
+    parent = os.path.dirname(rel)
+    if parent and parent not in idx['dirset']:
+        add_entry(idx, parent, is_dir=True)
+    if is_dir:
+        if rel not in idx['dirset']:
+            idx['dirset'].add(rel)
+            idx['dirs'].append(rel)
+            if os.path.basename(rel) == 'pkgconfig':
+                idx['pkgconfig'].append(rel)
+    elif is_so(os.path.basename(rel)):
+        idx['so'].append(rel)
+    elif rel.endswith('.cmake'):
+        idx['cmake'].append(rel)
+    elif rel.endswith('.pc'):
+        idx['pc'].append(rel)
+
+def under(rels, prefix):
+    """Entries of `rels` below the relative dir `prefix`, as paths relative to it."""
+    pre = prefix + os.sep
+    return [r[len(pre):] for r in rels if r.startswith(pre)]
@@ -1,3 +1,5 @@
+import fcntl
+import json
 import os
 import subprocess
 import tempfile
@@ -5,97 +7,191 @@ import zipfile
 from pathlib import Path
 import glob
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from . import resolver, fsindex, wheel, elf, rewriter, output, profiling
 
 def get_installed_package_path(pkg_name):
-    try:
-        out = subprocess.check_output(['pip','show',pkg_name], text=True)
-        for line in out.splitlines():
-            if line.startswith('Location:'):
-                loc = line.split(':',1)[1].strip()
-                return Path(loc) / pkg_name.replace('-', '_')
-    except subprocess.CalledProcessError:
-        return None
+    return resolver.resolve_package(pkg_name)
 
-def find_subdirs(base_dir: Path):
+@profiling.phase('find_subdirs')
+def find_subdirs(base_dir: Path, index=None):
     paths = {'include': [], 'lib': [], 'lib64': [], 'pkgconfig': [], 'cmake': [], 'bin': []}
     base = Path(base_dir)
     if not base.exists():
         return paths
-    for root, dirs, _ in os.walk(base):
-        for d in dirs:
-            full = Path(root) / d
-            name = d.lower()
-            if name == 'include':
-                paths['include'].append(str(full))
-                for subroot, subdirs, _ in os.walk(full):
-                    for sd in subdirs:
-                        paths['include'].append(str(Path(subroot)/sd))
-            elif name == 'lib':
-                paths['lib'].append(str(full))
-            elif name == 'lib64':
-                paths['lib64'].append(str(full))
-            elif name == 'pkgconfig':
-                paths['pkgconfig'].append(str(full))
-            elif 'cmake' in name:
-                paths['cmake'].append(str(full))
-            elif name == 'bin':
-                paths['bin'].append(str(full))
+    if index is None:
+        index = fsindex.index_tree(base)
+    dirs = index['dirs']
+    for rel in dirs:
+        full = base / rel
+        name = os.path.basename(rel).lower()
+        if name == 'include':
+            paths['include'].append(str(full))
+            paths['include'].extend(str(full / sd) for sd in fsindex.under(dirs, rel))
+        elif name == 'lib':
+            paths['lib'].append(str(full))
+        elif name == 'lib64':
+            paths['lib64'].append(str(full))
+        elif name == 'pkgconfig':
+            paths['pkgconfig'].append(str(full))
+        elif 'cmake' in name:
+            paths['cmake'].append(str(full))
+        elif name == 'bin':
+            paths['bin'].append(str(full))
     for k in paths:
         seen=set(); paths[k]=[p for p in paths[k] if not (p in seen or seen.add(p))]
     return paths
 
-def _link_if_missing(src: Path, dst: Path):
-    try:
-        if not dst.exists():
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            dst.symlink_to(src)
-    except Exception:
-        pass
+LINK_MODES = ('symlink', 'hardlink', 'reflink')
+_FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
 
-def fix_lib_layout(base_path):
+def plan_layout(base_path, index=None, mode='symlink'):
+    """The lib <-> lib64 mirror links fix_lib_layout makes, computed from one index of the
+    tree instead of a stat per file: {'base', 'mode', 'dirs': [dir to create, parents
+    first], 'links': [[dst, src], ...]} with paths relative to the base."""
+    if mode not in LINK_MODES:
+        raise ValueError(f'unknown link mode: {mode!r}')
     base = Path(base_path)
-    if base is None:
-        return base
-    if base.is_file() and base.suffix == '.whl':
-        tmp = Path(tempfile.mkdtemp(prefix='s390x_whl_'))
-        with zipfile.ZipFile(base, 'r') as zf:
-            zf.extractall(tmp)
-        base = tmp
-
-    lib = base / 'lib'
-    lib64 = base / 'lib64'
-
-    if lib.exists() and lib64.exists():
-        for so in lib.rglob('*.so*'):
-            target = lib64 / so.relative_to(lib)
-            _link_if_missing(so, target)
-        for so in lib64.rglob('*.so*'):
-            target = lib / so.relative_to(lib64)
-            _link_if_missing(so, target)
-        return base
+    if index is None:
+        index = fsindex.index_tree(base)
+    top = set(d for d in index['dirs'] if os.sep not in d)
+    present = set(index['so'])
+    links, dirs = [], set()
+    for src, dst in (('lib', 'lib64'), ('lib64', 'lib')):
+        # a symlinked dst (lib64 -> lib) already is the src tree
+        if src not in top or (dst in top and os.path.islink(base / dst)):
+            continue
+        # index['so'] is not updated while planning, so planned links are not mirrored back
+        for rel in fsindex.under(index['so'], src):
+            target = os.path.join(dst, rel)
+            if target in present:
+                continue
+            present.add(target)
+            links.append([target, os.path.join(src, rel)])
+            d = os.path.dirname(target)
+            while d and d not in index['dirset'] and d not in dirs:
+                dirs.add(d)
+                d = os.path.dirname(d)
+    return {'base': str(base), 'mode': mode, 'dirs': sorted(dirs), 'links': links}
 
-    if lib.exists() and not lib64.exists():
-        for so in lib.rglob('*.so*'):
-            dst = lib64 / so.relative_to(lib)
-            _link_if_missing(so, dst)
-        return base
+def _copy_symlink(src, dst):
+    # soname links (libfoo.so -> libfoo.so.1) stay links, pointing at the mirrored sibling
+    os.symlink(os.readlink(src), dst)
+    return 'linked'
 
-    if lib64.exists() and not lib.exists():
-        for so in lib64.rglob('*.so*'):
-            dst = lib / so.relative_to(lib64)
-            _link_if_missing(so, dst)
-        return base
+def _symlink(src, dst):
+    os.symlink(src, dst)
+    return 'linked'
+
+def _hardlink(src, dst):
+    if os.path.islink(src):
+        return _copy_symlink(src, dst)
+    os.link(src, dst)
+    return 'linked'
+
+def _reflink(src, dst):
+    """Clone `src` with the FICLONE ioctl (btrfs, xfs, ...); copy where that is unsupported."""
+    if os.path.islink(src):
+        return _copy_symlink(src, dst)
+    with open(src, 'rb') as fi:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, os.fstat(fi.fileno()).st_mode & 0o7777)
+        try:
+            try:
+                fcntl.ioctl(fd, _FICLONE, fi.fileno())
+                return 'linked'
+            except OSError:
+                with os.fdopen(fd, 'wb', closefd=False) as fo:
+                    shutil.copyfileobj(fi, fo)
+                profiling.count('bytes_written', os.fstat(fd).st_size)
+                return 'copied'
+        except BaseException:
+            os.unlink(dst)
+            raise
+        finally:
+            os.close(fd)
+
+_LINKERS = {'symlink': _symlink, 'hardlink': _hardlink, 'reflink': _reflink}
 
+def apply_layout(plan, index=None):
+    """Create the plan's directories, then its links. A link whose destination appeared
+    since planning is counted as existing; other failures are collected, not raised.
+    Created links are added to `index`. Returns {dirs, linked, copied, existing, errors}."""
+    base = Path(plan['base'])
+    make = _LINKERS[plan['mode']]
+    stats = {'dirs': 0, 'linked': 0, 'copied': 0, 'existing': 0, 'errors': []}
+    for rel in plan['dirs']:
+        try:
+            os.mkdir(base / rel)
+            stats['dirs'] += 1
+        except FileExistsError:
+            pass
+        except OSError as e:
+            stats['errors'].append([rel, e.strerror or str(e)])
+    for dst, src in plan['links']:
+        try:
+            stats[make(str(base / src), str(base / dst))] += 1
+        except FileExistsError:
+            stats['existing'] += 1
+            continue
+        except OSError as e:
+            stats['errors'].append([dst, e.strerror or str(e)])
+            continue
+        if index is not None:
+            fsindex.add_entry(index, dst)
+    return stats
+
+def print_plan(plan):
+    """Print a layout plan (and emit it as a 'link_plan' record) without applying it."""
+    base = Path(plan['base'])
+    output.emit({'type': 'link_plan', 'target': str(base), 'mode': plan['mode'],
+                 'dirs': plan['dirs'], 'links': plan['links']})
+    for rel in plan['dirs']:
+        print(f'[PLAN] mkdir {base / rel}')
+    for dst, src in plan['links']:
+        print(f"[PLAN] {plan['mode']} {base / dst} -> {base / src}")
+    print(f"[RESULT] {len(plan['links'])} links and {len(plan['dirs'])} directories planned for {base}")
+
+@profiling.phase('fix_lib_layout')
+def fix_lib_layout(base_path, index=None, link_mode='symlink', dry_run=False):
+    """Mirror the shared objects of lib/ into lib64/ and back, as `link_mode` links, and
+    return the fixed dir. A wheel is left untouched: it is extracted to a temp dir, which
+    is fixed and returned (fix_wheel / fix_target rewrite the archive in place instead).
+    With `dry_run`, only print the plan."""
+    if base_path is None:
+        return None
+    base = Path(base_path)
+    if base.is_file() and base.suffix == '.whl':
+        if dry_run:
+            print_plan(plan_wheel_layout(base))
+            return base
+        base, index = extract_wheel_to_temp(base), None
+    if index is None:
+        index = fsindex.index_tree(base)
+    plan = plan_layout(base, index, link_mode)
+    if dry_run:
+        print_plan(plan)
+        return base
+    stats = apply_layout(plan, index)
+    for rel, msg in stats['errors']:
+        print(f'[WARN] {base / rel}: {msg}')
     return base
 
 def extract_wheel_to_temp(whl_path):
+    """Extract the whole wheel into a new temp dir and return it; the caller removes it."""
     tmp = Path(tempfile.mkdtemp(prefix='s390x_whl_'))
-    with zipfile.ZipFile(str(whl_path),'r') as zf:
-        zf.extractall(tmp)
+    with zipfile.ZipFile(str(whl_path)) as zf:
+        wheel.extract_members(zf, zf.namelist(), tmp)
     return tmp
 
-def repack_wheel(extracted_dir: Path, original_whl_path):
+@profiling.phase('repack_wheel')
+def repack_wheel(extracted_dir: Path, original_whl_path, incremental=True):
     out_whl = Path(original_whl_path)
+    if incremental and out_whl.is_file():
+        # copy unchanged members' compressed bytes, recompress only what differs, fix RECORD
+        changed, removed = wheel.diff_extracted(extracted_dir, out_whl)
+        wheel.rewrite_wheel(out_whl, changed=changed, removed=removed)
+        return
     tmpname = out_whl.parent / (out_whl.name + '.fixed')
     with zipfile.ZipFile(tmpname, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
         for f in sorted(extracted_dir.rglob('*')):
@@ -104,101 +200,266 @@ def repack_wheel(extracted_dir: Path, original_whl_path):
                 zf.write(f, arc)
     tmpname.replace(out_whl)
 
-def rewrite_cmake_paths(base_dir: Path):
-    for cm in base_dir.rglob('*.cmake'):
-        try:
-            text = cm.read_text()
-            if '/lib/' in text and '/lib64/' not in text:
-                if (base_dir / 'lib64').exists():
-                    new = text.replace('/lib/', '/lib64/')
-                    cm.write_text(new)
-        except Exception:
-            pass
+@profiling.phase('rewrite_cmake_paths')
+def rewrite_cmake_paths(base_dir: Path, relocate=(), index=None):
+    """Rewrite lib -> lib64 (and `relocate` prefix pairs) in every .cmake and .pc file under
+    `base_dir`. lib64 presence is checked once per run. Returns rewriter stats."""
+    base = Path(base_dir)
+    if index is None:
+        index = fsindex.index_tree(base)
+    rules = rewriter.default_rules(has_lib64=(base / 'lib64').exists(), relocate=relocate)
+    stats = rewriter.rewrite_tree(base, index['cmake'] + index['pc'], rules)
+    _print_rewrite_stats(base, stats)
+    return stats
+
+def _print_rewrite_stats(where, stats):
+    output.emit(dict({'type': 'rewrite', 'target': str(where)}, **stats))
+    print(f"[OK] rewrote {stats['files_changed']} of {stats['files']} cmake/pkg-config files in {where} "
+          f"({stats['replacements']} paths, {stats['bytes_scanned']} bytes scanned)")
+
+def _wheel_layout_copies(names):
+    """Archive-level equivalent of fix_lib_layout: {missing lib/lib64 member: member to copy}.
+    Wheels cannot carry symlinks, so the compat entries are copies (as repacking links did)."""
+    present = set(names)
+    tops = set(n.split('/', 1)[0] for n in names if '/' in n)
+    copies = {}
+    for src, dst in (('lib', 'lib64'), ('lib64', 'lib')):
+        if src not in tops:
+            continue
+        for n in names:
+            if n.startswith(src + '/') and fsindex.is_so(n.rsplit('/', 1)[-1]):
+                target = dst + n[len(src):]
+                if target not in present and target not in copies:
+                    copies[target] = n
+    return copies
+
+def plan_wheel_layout(whl):
+    """plan_layout() for a wheel: the members fix_wheel would copy, as a 'copy' mode plan."""
+    with zipfile.ZipFile(str(whl)) as zf:
+        copies = _wheel_layout_copies([n for n in zf.namelist() if not n.endswith('/')])
+    return {'base': str(whl), 'mode': 'copy', 'dirs': [], 'links': sorted([d, s] for d, s in copies.items())}
+
+@profiling.phase('fix_wheel')
+def fix_wheel(whl, rewrite_cmake=False, relocate=()):
+    """Fix a wheel in place, reading only the members that may change (.cmake text) and
+    rewriting the archive only when something actually changed. Returns True if rewritten."""
+    with zipfile.ZipFile(str(whl)) as zf:
+        names = [n for n in zf.namelist() if not n.endswith('/')]
+        copies = _wheel_layout_copies(names)
+        changed = {}
+        if rewrite_cmake:
+            has_lib64 = any(n.startswith('lib64/') for n in names + list(copies))
+            compiled = rewriter.compile_rules(rewriter.default_rules(has_lib64, relocate))
+            stats = {'files': 0, 'bytes_scanned': 0, 'files_changed': 0, 'replacements': 0}
+            for n in names:
+                if not n.endswith(rewriter.REWRITE_SUFFIXES):
+                    continue
+                data = zf.read(n)
+                new, count = rewriter.rewrite_bytes(data, compiled)
+                stats['files'] += 1
+                stats['bytes_scanned'] += len(data)
+                if new is not None:
+                    changed[n] = new
+                    stats['files_changed'] += 1
+                    stats['replacements'] += count
+            _print_rewrite_stats(whl, stats)
+    return wheel.rewrite_wheel(whl, changed=changed, copies=copies)
 
-def fix_target(target, rewrite_cmake=False):
+def fix_target(target, rewrite_cmake=False, relocate=(), link_mode='symlink', dry_run=False):
     p = Path(target)
-    if p.suffix == '.whl':
-        base = extract_wheel_to_temp(p)
-        fix_lib_layout(base)
+    if dry_run:
+        fix_lib_layout(p, link_mode=link_mode, dry_run=True)
         if rewrite_cmake:
-            rewrite_cmake_paths(base)
-        repack_wheel(base, p)
+            print(f'[INFO] dry run: cmake/pkg-config rewrite of {p} not planned')
+        return
+    if p.suffix == '.whl':
+        fix_wheel(p, rewrite_cmake=rewrite_cmake, relocate=relocate)
     else:
-        fix_lib_layout(p)
+        index = fsindex.index_tree(p)
+        fix_lib_layout(p, index=index, link_mode=link_mode)
         if rewrite_cmake:
-            rewrite_cmake_paths(p)
+            rewrite_cmake_paths(p, relocate=relocate, index=index)
 
+@lru_cache(maxsize=None)
 def _has_patchelf():
+    from . import runner  # asyncio: only loaded when a tool is actually run
     try:
-        subprocess.check_output(['patchelf','--version'], stderr=subprocess.STDOUT)
+        runner.run(['patchelf', '--version'], timeout=30)
         return True
-    except Exception:
+    except (OSError, subprocess.SubprocessError):
         return False
 
 def _patch_rpath_file(file_path: Path, rpath: str):
-    if not _has_patchelf():
-        print('[WARN] patchelf not available; skipping')
-        return
+    """Set the rpath of one file without spawning anything. Returns (status, detail) with
+    status one of 'ok', 'unchanged', 'skipped' or 'pending' (patchelf is needed)."""
+    try:
+        info = elf.read_dynamic(str(file_path))
+    except (OSError, elf.ElfError) as e:
+        return 'skipped', f'not an ELF object ({e})'
+    current = info['runpath'] if info['runpath'] is not None else info['rpath']
+    if current == rpath:
+        return 'unchanged', ''
     try:
-        subprocess.check_call(['patchelf','--set-rpath', rpath, str(file_path)])
-        print(f'[OK] set-rpath {rpath} -> {file_path}')
-    except Exception as e:
-        print(f'[ERR] patchelf failed for {file_path}: {e}')
+        # fast path: no subprocess when the new value fits the existing .dynstr slot
+        if elf.set_runpath_inplace(str(file_path), rpath):
+            return 'ok', 'in-place'
+    except (OSError, elf.ElfError):
+        pass
+    return 'pending', ''
 
-def patch_rpath_target(target, rpath=''):
+def _patchelf_status(res):
+    if isinstance(res, subprocess.CalledProcessError):
+        return 'failed', (res.output or '').strip() or str(res)
+    if isinstance(res, subprocess.TimeoutExpired):
+        return 'failed', f'patchelf timed out after {res.timeout:g}s'
+    if isinstance(res, BaseException):
+        return 'failed', str(res)
+    return 'ok', 'patchelf'
+
+def _patch_files(files, rpath, jobs=None):
+    """In-place edits on `jobs` threads first; the files that still need patchelf then run
+    through the shared subprocess runner, `jobs` at a time, each with a timeout so a hung
+    patchelf fails its own file only. Returns (status, detail) per file, in order."""
+    from . import runner
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as ex:
+        results = list(ex.map(lambda f: _patch_rpath_file(f, rpath), files))
+    pending = [i for i, (st, _) in enumerate(results) if st == 'pending']
+    if pending and not _has_patchelf():
+        for i in pending:
+            results[i] = ('skipped', 'patchelf not available')
+    elif pending:
+        done = runner.run_many([['patchelf', '--set-rpath', rpath, str(files[i])] for i in pending], jobs=jobs)
+        for i, res in zip(pending, done):
+            results[i] = _patchelf_status(res)
+    return results
+
+def _print_patch_summary(labels, results, rpath):
+    counts = {}
+    for label, (status, detail) in zip(labels, results):
+        counts[status] = counts.get(status, 0) + 1
+        output.emit({'type': 'rpath', 'file': str(label), 'rpath': rpath, 'status': status, 'detail': detail or None})
+        if status == 'ok':
+            print(f'[OK] set-rpath {rpath} -> {label}')
+        elif status == 'failed':
+            print(f'[ERR] patchelf failed for {label}: {detail}')
+    if counts.get('skipped'):
+        reasons = sorted(set(d for st, d in results if st == 'skipped'))
+        print(f"[WARN] skipped {counts['skipped']} files: {'; '.join(reasons)}")
+    inplace = sum(1 for st, d in results if st == 'ok' and d == 'in-place')
+    print(f"[RESULT] {counts.get('ok', 0)} patched ({inplace} in place), {counts.get('unchanged', 0)} already set, "
+          f"{counts.get('skipped', 0)} skipped, {counts.get('failed', 0)} failed")
+
+@profiling.phase('patch_rpath')
+def patch_rpath_target(target, rpath='', jobs=None):
+    """Patch every .so under `target` (dir or wheel) to `rpath` on `jobs` threads.
+    Files whose RPATH/RUNPATH already equals `rpath` are left alone; symlinks are skipped
+    and each real file is patched once. Returns the per-file (status, detail) results in
+    sorted file order."""
     p = Path(target)
+    if not rpath:
+        rpath = '/usr/lib64'
     if p.suffix == '.whl':
-        base = extract_wheel_to_temp(p)
-        if not rpath:
-            rpath = '/usr/lib64'
-        for so in base.rglob('*.so*'):
-            _patch_rpath_file(so, rpath)
-        repack_wheel(base, p)
+        # only the shared objects are extracted; the temp dir goes away with the block
+        with tempfile.TemporaryDirectory(prefix='s390x_whl_') as tmp:
+            with zipfile.ZipFile(str(p)) as zf:
+                names = sorted(n for n in zf.namelist() if fsindex.is_so(n.rsplit('/', 1)[-1]))
+                files = wheel.extract_members(zf, names, tmp)
+            results = _patch_files(files, rpath, jobs)
+            changed = {n: f.read_bytes() for n, f, (st, _) in zip(names, files, results) if st == 'ok'}
+        wheel.rewrite_wheel(p, changed=changed)
+        labels = [f'{p}:{n}' for n in names]
     else:
-        base = p
-        if not rpath:
-            rpath = '/usr/lib64'
-        for so in base.rglob('*.so*'):
-            _patch_rpath_file(so, rpath)
-
-SITE_CUSTOMIZE = r"""import sysconfig, os, glob
-vars = sysconfig._CONFIG_VARS
-default_libdir = vars.get('LIBDIR', '/usr/lib')
-lib_candidates = [default_libdir, default_libdir.replace('/lib','/lib64')]
-selected = None
-for candidate in lib_candidates:
-    if os.path.exists(candidate):
-        so_files = glob.glob(os.path.join(candidate, '**', '*.so*'), recursive=True)
-        if so_files:
-            selected = candidate
-if not selected:
+        # soname links and the lib/lib64 links `fix` makes reach the same file several
+        # times; patching it concurrently from two names would corrupt it
+        files, seen = [], set()
+        for f in sorted(p.rglob('*.so*')):
+            if f.is_symlink() or not f.is_file():
+                continue
+            st = f.stat()
+            if (st.st_dev, st.st_ino) not in seen:  # also catches hard links and symlinked dirs
+                seen.add((st.st_dev, st.st_ino))
+                files.append(f)
+        results = _patch_files(files, rpath, jobs)
+        labels = files
+    _print_patch_summary(labels, results, rpath)
+    return results
+
+# LIBDIR is decided once at injection time, so interpreter startup pays no filesystem scan
+SITE_CUSTOMIZE = r"""# Generated by s390x-auto-path inject-sitecustomize; re-run with --refresh to re-detect.
+import os, sysconfig
+LIBDIR = {libdir!r}
+sysconfig.get_config_vars()['LIBDIR'] = LIBDIR
+os.environ['LIBDIR'] = LIBDIR
+"""
+SITE_CUSTOMIZE_MARKER = '# Generated by s390x-auto-path'
+
+def _has_any_so(root):
+    for _, _, files in os.walk(root):
+        if any(fsindex.is_so(f) for f in files):
+            return True
+    return False
+
+def detect_libdir(default_libdir):
+    """lib vs lib64 choice for a venv: the lib64 variant wins when it has shared objects,
+    then any existing candidate, then `default_libdir` itself."""
+    if default_libdir.endswith('/lib64'):
+        default_libdir = default_libdir[:-2]
+    lib_candidates = [default_libdir, default_libdir.replace('/lib','/lib64')]
+    selected = None
     for candidate in lib_candidates:
-        if os.path.exists(candidate):
+        if os.path.exists(candidate) and _has_any_so(candidate):
             selected = candidate
-if not selected:
-    selected = default_libdir
-vars['LIBDIR'] = selected
-os.environ['LIBDIR'] = selected
-"""
+    if not selected:
+        for candidate in lib_candidates:
+            if os.path.exists(candidate):
+                selected = candidate
+    return selected or default_libdir
+
+# run with -S: site would import the sitecustomize we injected and report our own LIBDIR,
+# so the venv's purelib comes from its scheme with the venv as base (argv[1])
+_VENV_PROBE = ("import json, sys, sysconfig; v = sys.argv[1]; "
+               "scheme = 'venv' if 'venv' in sysconfig.get_scheme_names() else 'posix_prefix'; "
+               "print(json.dumps({'ver': '%d.%d' % sys.version_info[:2], "
+               "'purelib': sysconfig.get_paths(scheme, vars={'base': v, 'platbase': v})['purelib'], "
+               "'libdir': sysconfig.get_config_var('LIBDIR') or '/usr/lib'}))")
+
+@profiling.phase('inject_sitecustomize')
+def inject_sitecustomize_into_venv(venv_path: Path, refresh=False):
+    from . import runner
+    pybin = venv_path / 'bin' / 'python'
+    if not pybin.exists():
+        print('[ERR] python not found in venv')
+        output.emit({'type': 'sitecustomize', 'venv': str(venv_path), 'status': 'error', 'error': 'python not found in venv'})
+        return
+    probe = json.loads(runner.run([pybin, '-S', '-c', _VENV_PROBE, os.path.abspath(str(venv_path))],
+                                  merge_stderr=False)['stdout'])
+    dest = Path(probe['purelib'])
+    target = dest / 'sitecustomize.py'
+    if not refresh and target.exists() and target.read_text().startswith(SITE_CUSTOMIZE_MARKER):
+        print(f'[OK] sitecustomize.py already present in {dest} (use --refresh to re-detect LIBDIR)')
+        output.emit({'type': 'sitecustomize', 'venv': str(venv_path), 'path': str(target), 'status': 'present'})
+        return
+    libdir = detect_libdir(probe['libdir'])
+    dest.mkdir(parents=True, exist_ok=True)
+    target.write_text(SITE_CUSTOMIZE.format(libdir=libdir))
+    print(f'[OK] injected sitecustomize.py into {dest} (LIBDIR={libdir})')
+    output.emit({'type': 'sitecustomize', 'venv': str(venv_path), 'path': str(target), 'libdir': libdir, 'status': 'written'})
 
-def find_deep_cmake_dirs_from_packages(pkg_paths):
+@profiling.phase('deep_cmake_scan')
+def find_deep_cmake_dirs_from_packages(pkg_paths, indexes=None):
     """Search deeper inside package folders for cmake directories, including nonstandard locations like
-    wheel_payload/lib64/aws-c-common/cmake. Returns list of cmake dirs to add to CMAKE_PREFIX_PATH."""
+    wheel_payload/lib64/aws-c-common/cmake. Returns list of cmake dirs to add to CMAKE_PREFIX_PATH.
+    `indexes` maps str(pkg_path) to a prebuilt fsindex so the package tree is not walked again."""
     found=[]
     for p in (pkg_paths or []):
         if not p:
             continue
         base = Path(p)
-        # look for cmake dirs under lib and lib64 recursively, include wheel_payload
-        candidates = list(base.rglob('**/cmake'))
-        for c in candidates:
-            # prefer directories that contain AwsCFlags.cmake or AwsFindPackage.cmake
-            names = [x.name for x in c.iterdir() if x.is_file()]
-            if any(n.lower().startswith('awscflags') or n.lower().startswith('awsfindpackage') or 'aws' in n.lower() for n in names):
-                found.append(str(c))
-            else:
-                # keep reasonable cmake dirs too
-                found.append(str(c))
+        index = (indexes or {}).get(str(p))
+        if index is None:
+            index = fsindex.index_tree(base)
+        # every dir named cmake counts, whether or not it carries the Aws*.cmake modules
+        found.extend(str(base / d) for d in index['dirs'] if os.path.basename(d) == 'cmake')
     # dedupe preserving order
     seen=set(); out=[]
     for x in found:
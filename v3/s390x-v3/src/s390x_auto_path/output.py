@@ -0,0 +1,91 @@
+import contextlib
+import json
+import sys
+import threading
+
+FORMATS = ('text', 'json', 'ndjson')
+
+_lock = threading.Lock()
+_state = {'format': 'text', 'stream': None, 'records': [], 'queue': None}
+# per-thread capture() list, overriding the process-wide configuration for that thread
+_local = threading.local()
+
+def configure(fmt='text', stream=None):
+    """Select the output format. In json/ndjson mode records go to `stream` (default: the
+    current stdout) and callers route human-readable lines elsewhere (the CLI: stderr)."""
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown output format: {fmt!r}')
+    with _lock:
+        _state['format'] = fmt
+        _state['stream'] = stream
+        _state['records'] = []
+        _state['queue'] = None
+
+def current():
+    if getattr(_local, 'records', None) is not None:
+        return 'json'
+    return _state['format']
+
+def structured():
+    return current() != 'text'
+
+def emit(record):
+    """Emit one record: written and flushed at once for ndjson, kept for the final
+    document for json, dropped for text (the caller prints its own lines). Inside
+    capture() it goes to that thread's list instead."""
+    captured = getattr(_local, 'records', None)
+    if captured is not None:
+        captured.append(record)
+        return
+    fmt = _state['format']
+    if fmt == 'text':
+        return
+    if fmt == 'ndjson':
+        if _state['queue'] is not None:
+            _state['queue'].put(record)
+            return
+        line = json.dumps(record, default=str) + '\n'
+        with _lock:
+            stream = _state['stream'] or sys.stdout
+            stream.write(line)
+            stream.flush()
+    else:
+        with _lock:
+            _state['records'].append(record)
+
+def collect(fmt):
+    """Buffer records instead of writing them (pool workers return them to the parent)."""
+    configure('json' if fmt != 'text' else 'text')
+
+def forward(queue):
+    """Put ndjson records on `queue` as they are emitted (pool workers stream them to the
+    parent, which writes them)."""
+    configure('ndjson')
+    _state['queue'] = queue
+
+def drain():
+    with _lock:
+        records, _state['records'] = _state['records'], []
+    return records
+
+def finish():
+    """Write the json document (a list of all records); nothing to do for other formats."""
+    if _state['format'] == 'json':
+        stream = _state['stream'] or sys.stdout
+        json.dump(drain(), stream, indent=1, default=str)
+        stream.write('\n')
+        stream.flush()
+
+@contextlib.contextmanager
+def capture():
+    """Collect the records emitted by this thread inside the block into the yielded list,
+    whatever the configured format; other threads and the process-wide configuration are
+    not affected (api.Session builds its result objects from them). Work handed to other
+    threads must decide structured() in the capturing thread."""
+    records = []
+    saved = getattr(_local, 'records', None)
+    _local.records = records
+    try:
+        yield records
+    finally:
+        _local.records = saved
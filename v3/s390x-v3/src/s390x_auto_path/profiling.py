@@ -0,0 +1,80 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+COUNTERS = ('files_visited', 'subprocesses', 'bytes_read', 'bytes_written')
+
+_lock = threading.Lock()
+_state = {'enabled': False, 'events': [], 'counters': dict.fromkeys(COUNTERS, 0)}
+
+def enable(on=True):
+    with _lock:
+        _state['enabled'] = on
+        _state['events'] = []
+        _state['counters'] = dict.fromkeys(COUNTERS, 0)
+
+def enabled():
+    return _state['enabled']
+
+def count(key, n=1):
+    """Add `n` to a process-wide counter; a no-op unless profiling is enabled."""
+    if _state['enabled']:
+        with _lock:
+            _state['counters'][key] += n
+
+@contextlib.contextmanager
+def phase(name, **args):
+    """Record wall time and the counter deltas of the enclosed block as one event.
+    Counters are process-wide, so a phase includes work done by its worker threads."""
+    if not _state['enabled']:
+        yield
+        return
+    before = dict(_state['counters'])
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        dur = time.perf_counter_ns() - start
+        with _lock:
+            delta = {k: _state['counters'][k] - before[k] for k in COUNTERS}
+            _state['events'].append({'name': name, 'ts': start // 1000, 'dur': dur // 1000, 'pid': os.getpid(),
+                                     'tid': threading.get_ident(), 'args': dict(args, **delta)})
+
+def drain():
+    """Return and clear the events recorded so far (used to ship them out of pool workers)."""
+    with _lock:
+        events, _state['events'] = _state['events'], []
+    return events
+
+def merge(events):
+    with _lock:
+        _state['events'].extend(events or [])
+
+def summary(events=None):
+    """Aggregate events by phase name: {name: {calls, seconds, <counters>}} in first-seen order."""
+    out = {}
+    for ev in (_state['events'] if events is None else events):
+        agg = out.setdefault(ev['name'], dict({'calls': 0, 'seconds': 0.0}, **dict.fromkeys(COUNTERS, 0)))
+        agg['calls'] += 1
+        agg['seconds'] += ev['dur'] / 1e6
+        for k in COUNTERS:
+            agg[k] += ev['args'].get(k, 0)
+    return out
+
+def print_summary(events=None, file=None):
+    rows = summary(events)
+    if not rows:
+        return
+    width = max(len('PHASE'), max(len(n) for n in rows))
+    print(f"{'PHASE':<{width}}  CALLS  SECONDS    FILES  SUBPROC   BYTES_READ  BYTES_WRITTEN", file=file)
+    for name, r in rows.items():
+        print(f"{name:<{width}}  {r['calls']:5d}  {r['seconds']:7.3f}  {r['files_visited']:7d}  {r['subprocesses']:7d}"
+              f"  {r['bytes_read']:11d}  {r['bytes_written']:13d}", file=file)
+
+def write_trace(path, events=None):
+    """Write Chrome trace-event JSON (load in chrome://tracing or Perfetto)."""
+    trace = [dict(ev, ph='X', cat='s390x-auto-path') for ev in (_state['events'] if events is None else events)]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
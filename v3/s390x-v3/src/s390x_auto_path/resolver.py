@@ -0,0 +1,109 @@
+import re
+import sys
+from pathlib import Path
+from . import profiling
+
+def _importlib_metadata():
+    # imported on first use: it pulls in zipfile, email and tempfile, which commands that
+    # only need normalize_name() (cache, validate) should not load at startup
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: no cover
+        return None
+    return metadata
+
+def normalize_name(name):
+    """PEP 503 normalization so 'aws_lc', 'AWS-LC' and 'aws.lc' all match."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def _dist_name(dist):
+    try:
+        return dist.metadata['Name'] or ''
+    except Exception:
+        return ''
+
+def _dist_location(dist):
+    try:
+        return Path(dist.locate_file(''))
+    except Exception:
+        return None
+
+def _top_level_dirs(dist):
+    """Top-level directories a distribution installs, read from its dist-info RECORD."""
+    tops = []
+    for f in (dist.files or []):
+        parts = Path(str(f)).parts
+        if len(parts) < 2 or parts[0] == '..':
+            continue
+        top = parts[0]
+        if top.endswith(('.dist-info', '.egg-info', '.data')) or top == '__pycache__':
+            continue
+        if top not in tops:
+            tops.append(top)
+    return tops
+
+def _package_dir(dist, name):
+    loc = _dist_location(dist)
+    if loc is None:
+        return None
+    guess = name.replace('-', '_')
+    tops = _top_level_dirs(dist)
+    for t in tops:
+        if normalize_name(t) == normalize_name(guess):
+            return loc / t
+    public = [t for t in tops if not t.startswith('_')]
+    if public or tops:
+        return loc / (public or tops)[0]
+    # no RECORD (e.g. some legacy installs): keep the historical pip-show guess
+    return loc / guess
+
+@profiling.phase('resolve')
+def resolve_packages(names):
+    """Resolve installed package directories for all `names` in one in-process pass.
+
+    Distribution names are matched first. Names that are not a distribution are then
+    looked up as import names through each distribution's RECORD, so both `aws-lc` and
+    the package's import name resolve. Returns {name: Path or None} in input order."""
+    names = list(names)
+    result = {n: None for n in names}
+    importlib_metadata = _importlib_metadata()
+    if importlib_metadata is None:
+        return result
+    wanted = {}
+    for n in names:
+        wanted.setdefault(normalize_name(n), []).append(n)
+    dists = list(importlib_metadata.distributions())
+    seen = set()
+    for dist in dists:
+        key = normalize_name(_dist_name(dist))
+        # first hit on sys.path wins, like pip/import
+        if key in wanted and key not in seen:
+            seen.add(key)
+            for n in wanted[key]:
+                result[n] = _package_dir(dist, n)
+    missing = [n for n in names if result[n] is None]
+    if missing:
+        by_import = {}
+        for dist in dists:
+            loc = _dist_location(dist)
+            if loc is None:
+                continue
+            for t in _top_level_dirs(dist):
+                by_import.setdefault(normalize_name(t), loc / t)
+        for n in missing:
+            key = normalize_name(n.replace('-', '_'))
+            if key in by_import:
+                result[n] = by_import[key]
+    for n in names:
+        if result[n] is not None:
+            continue
+        # namespace or vendored dirs without metadata: plain sys.path probe
+        for entry in sys.path:
+            cand = Path(entry or '.') / n.replace('-', '_')
+            if cand.is_dir():
+                result[n] = cand
+                break
+    return result
+
+def resolve_package(name):
+    return resolve_packages([name])[name]
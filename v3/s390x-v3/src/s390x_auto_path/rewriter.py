@@ -0,0 +1,114 @@
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from . import profiling
+
+# `${_IMPORT_PREFIX}/lib`-style references that end the path component without a slash,
+# e.g. INTERFACE_LINK_DIRECTORIES "${_IMPORT_PREFIX}/lib" or pkg-config libdir=${exec_prefix}/lib
+_PREFIX_VARS = rb'\$\{(?:_IMPORT_PREFIX|PACKAGE_PREFIX_DIR|CMAKE_CURRENT_LIST_DIR|prefix|exec_prefix)\}'
+_PREFIX_LIB = _PREFIX_VARS + rb'/lib(?=["\';:\s)]|$)'
+
+REWRITE_SUFFIXES = ('.cmake', '.pc')
+
+def default_rules(has_lib64=True, relocate=()):
+    """Path rules as (name, pattern, replacement, guard). `pattern` is a bytes regex without
+    capture groups, `replacement` bytes or a callable on the matched bytes, and a rule is not
+    applied to files that already contain `guard`."""
+    rules = []
+    for i, (old, new) in enumerate(relocate):
+        rules.append((f'relocate{i}', re.escape(old.encode()), new.encode(), None))
+    if has_lib64:
+        rules.append(('import_prefix', _PREFIX_LIB, lambda b: b + b'64', b'/lib64'))
+        rules.append(('lib', rb'/lib/', b'/lib64/', b'/lib64/'))
+    return rules
+
+def compile_rules(rules):
+    """One alternation regex for the whole rule set; returns (regex, {group: rule})."""
+    if not rules:
+        return None, {}
+    parts, by_group = [], {}
+    for i, (name, pattern, repl, guard) in enumerate(rules):
+        group = f'r{i}'
+        parts.append(b'(?P<' + group.encode() + b'>' + pattern + b')')
+        by_group[group] = (name, repl, guard)
+    return re.compile(b'|'.join(parts), re.MULTILINE), by_group
+
+def rewrite_bytes(data, compiled):
+    """Apply the compiled rules to `data`; returns (new bytes or None, replacements)."""
+    regex, by_group = compiled
+    if regex is None or regex.search(data) is None:
+        return None, 0
+    data = bytes(data)
+    guarded = set(g for g, (_, _, guard) in by_group.items() if guard is not None and guard in data)
+    count = [0]
+
+    def sub(m):
+        group = m.lastgroup
+        if group in guarded:
+            return m.group(0)
+        _, repl, _ = by_group[group]
+        count[0] += 1
+        return repl(m.group(0)) if callable(repl) else repl
+    new = regex.sub(sub, data)
+    if not count[0]:
+        return None, 0
+    return new, count[0]
+
+def _atomic_write(path, data):
+    # through a symlink, replace the file it points at and keep the link
+    path = os.path.realpath(path)
+    d = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(prefix='.s390x_', dir=d)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def rewrite_file(path, compiled):
+    """Rewrite one file in place if any rule matches. Non-matching files are only scanned
+    through a read-only mmap and never decoded or copied. Returns (bytes scanned, replacements)."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        profiling.count('bytes_read', size)
+        if not size:
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if compiled[0] is None or compiled[0].search(m) is None:
+                return size, 0
+            new, count = rewrite_bytes(m, compiled)
+    if new is not None:
+        _atomic_write(path, new)
+        profiling.count('bytes_written', len(new))
+    return size, count
+
+def rewrite_tree(base_dir, files, rules):
+    """Rewrite `files` (paths relative to `base_dir`) with `rules`; a file reached through
+    several symlinks is rewritten once, in place of its target. Returns stats: files, bytes_scanned, files_changed, replacements, errors."""
+    compiled = compile_rules(rules)
+    stats = {'files': 0, 'bytes_scanned': 0, 'files_changed': 0, 'replacements': 0, 'errors': 0}
+    seen = set()
+    for rel in files:
+        path = os.path.join(str(base_dir), rel)
+        real = os.path.realpath(path)
+        if real in seen:  # a symlink and its target are one file
+            continue
+        seen.add(real)
+        try:
+            size, count = rewrite_file(path, compiled)
+        except OSError as e:
+            print(f'[WARN] cannot rewrite {path}: {e}')
+            stats['errors'] += 1
+            continue
+        stats['files'] += 1
+        stats['bytes_scanned'] += size
+        if count:
+            stats['files_changed'] += 1
+            stats['replacements'] += count
+    return stats
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import signal
+import subprocess
+import time
+from . import profiling
+
+# per-call timeout for external tools; override with S390X_AUTO_PATH_TOOL_TIMEOUT (seconds)
+DEFAULT_TIMEOUT = 120.0
+
+def default_timeout():
+    try:
+        return float(os.environ.get('S390X_AUTO_PATH_TOOL_TIMEOUT', DEFAULT_TIMEOUT))
+    except ValueError:
+        return DEFAULT_TIMEOUT
+
+async def _run_once(argv, timeout, merge_stderr):
+    profiling.count('subprocesses')
+    # own process group, so a timeout also kills whatever the tool started (and the
+    # pipes it holds open)
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+        start_new_session=True)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException as e:
+        # timeout, but also Ctrl-C / task cancellation: never leave the tool running
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            proc.kill()
+        await proc.wait()
+        if isinstance(e, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(argv, timeout)
+        raise
+    return proc.returncode, out, err
+
+async def run_async(argv, timeout=None, retries=0, check=True, merge_stderr=True, limit=None):
+    """Run `argv` without a shell and capture its output.
+
+    A call that times out (the process is killed) or cannot be spawned is retried up to
+    `retries` more times (default: none, a hung tool already costs a full timeout); a
+    non-zero exit is never retried, since tools fail deterministically.
+    `limit` is an asyncio.Semaphore bounding concurrent processes. Returns a dict with
+    argv, returncode, stdout, stderr (text), seconds and attempts. With `check`, raises
+    subprocess.CalledProcessError / TimeoutExpired like subprocess.check_output."""
+    argv = [str(a) for a in argv]
+    timeout = default_timeout() if timeout is None else timeout
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if limit is not None:
+                async with limit:
+                    code, out, err = await _run_once(argv, timeout, merge_stderr)
+            else:
+                code, out, err = await _run_once(argv, timeout, merge_stderr)
+            break
+        except (subprocess.TimeoutExpired, OSError):
+            if attempt > retries:
+                raise
+    res = {'argv': argv, 'returncode': code,
+           'stdout': (out or b'').decode('utf-8', 'replace'), 'stderr': (err or b'').decode('utf-8', 'replace'),
+           'seconds': time.monotonic() - start, 'attempts': attempt}
+    if check and code != 0:
+        raise subprocess.CalledProcessError(code, argv, res['stdout'], res['stderr'])
+    return res
+
+def _run_sync(coro):
+    """asyncio.run(coro), on a helper thread when this thread already runs an event loop
+    (async code calling api.Session), where asyncio.run() raises RuntimeError. The
+    caller's loop is blocked until the tools finish, as with any synchronous call."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+def run(argv, **kwargs):
+    """Synchronous run_async() for a single call."""
+    return _run_sync(run_async(argv, **kwargs))
+
+def run_many(cmds, jobs=None, **kwargs):
+    """Run independent commands concurrently, at most `jobs` at a time (default: CPU count).
+    Returns one entry per command, in order: the result dict or the exception it raised,
+    so one failing or hung tool does not stop the others."""
+    cmds = list(cmds)
+    if not cmds:
+        return []
+
+    async def main():
+        limit = asyncio.Semaphore(max(1, jobs or os.cpu_count() or 1))
+        return await asyncio.gather(*(run_async(c, limit=limit, **kwargs) for c in cmds), return_exceptions=True)
+    return _run_sync(main())
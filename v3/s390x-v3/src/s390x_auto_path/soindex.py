@@ -0,0 +1,106 @@
+import hashlib
+import os
+from . import cache, elf, fsindex
+
+# always indexed, on top of ld.so.conf and the loader's defaults
+SYSTEM_DIRS = ('/lib64', '/usr/lib64', '/lib', '/usr/lib')
+
+_memo = {}
+
+def package_lib_dirs():
+    """lib/lib64 dirs of every package `env generate` has scanned (from the scan cache)."""
+    dirs = []
+    for _, value in cache.values('env'):
+        parts = (value or {}).get('parts') or {}
+        dirs.extend(parts.get('lib', []) + parts.get('lib64', []))
+    return dirs
+
+def default_dirs(sysroot='', extra=()):
+    """(dir, origin) pairs: loader dirs for both ELF classes, then scanned package lib dirs."""
+    out, seen = [], set()
+    system = list(elf.system_dirs(sysroot, 64)) + list(elf.system_dirs(sysroot, 32)) + [sysroot + d for d in SYSTEM_DIRS]
+    for d, origin in [(d, 'system') for d in system] + [(d, 'package') for d in list(extra) + package_lib_dirs()]:
+        d = os.path.normpath(d)
+        if d not in seen and os.path.isdir(d):
+            seen.add(d)
+            out.append((d, origin))
+    return out
+
+def _dir_stamps(dirs):
+    stamps = {}
+    for d, _ in dirs:
+        try:
+            stamps[d] = os.stat(d).st_mtime_ns
+        except OSError:
+            stamps[d] = None
+    return stamps
+
+def build(dirs):
+    """Index the shared objects directly in each (dir, origin). Returns
+    {soname: [[path, class, machine, origin], ...]} in search order."""
+    libs = {}
+    for d, origin in dirs:
+        try:
+            names = sorted(os.listdir(d))
+        except OSError:
+            continue
+        for name in names:
+            if not fsindex.is_so(name):
+                continue
+            path = os.path.join(d, name)
+            try:
+                ident = elf.read_ident(path)
+            except OSError:
+                continue
+            if ident is not None:
+                libs.setdefault(name, []).append([path, ident[0], ident[1], origin])
+    return libs
+
+def load(sysroot='', extra=(), use_cache=True):
+    """The soname index for `sysroot` plus `extra` package lib dirs. Rebuilt only when
+    a directory's mtime changed (files added or removed); otherwise read back from the
+    cache, and memoized per process."""
+    dirs = default_dirs(sysroot, extra)
+    stamps = _dir_stamps(dirs)
+    key = sysroot + '\0' + '\0'.join(f'{d}={o}' for d, o in dirs)
+    fp = hashlib.sha256(repr(sorted(stamps.items())).encode()).hexdigest()
+    hit = _memo.get(key)
+    if hit and hit[0] == fp:
+        return hit[1]
+    libs = cache.get('soindex', key, fp) if use_cache else None
+    if libs is None:
+        libs = build(dirs)
+        if use_cache:
+            cache.put('soindex', key, fp, libs)
+    _memo[key] = (fp, libs)
+    return libs
+
+def with_files(libs, infos, origin='target'):
+    """Copy of `libs` that also offers `infos` ({path: parsed ELF info or None}), searched first."""
+    out = dict(libs)
+    for path, info in sorted(infos.items()):
+        if info is not None:
+            name = os.path.basename(path)
+            out[name] = [[path, info['class'], info['machine'], origin]] + list(out.get(name, ()))
+    return out
+
+def lookup(libs, soname, ref=None):
+    """Indexed paths providing `soname`, restricted to `ref`'s ELF class and machine."""
+    return [c for c in libs.get(soname, ())
+            if ref is None or (c[1] == ref['class'] and c[2] == ref['machine'])]
+
+def suggest(libs, soname, so, ref=None):
+    """A fix for `so` missing `soname`: the first compatible candidate, the directory to put
+    on LD_LIBRARY_PATH and the equivalent $ORIGIN-relative RUNPATH entry; None if unknown."""
+    found = lookup(libs, soname, ref)
+    if not found:
+        return None
+    path, _, _, origin = found[0]
+    d = os.path.dirname(path)
+    if origin == 'system':
+        rpath = d
+    else:
+        rel = os.path.relpath(d, os.path.dirname(os.path.abspath(so)))
+        rpath = '$ORIGIN' if rel == '.' else f'$ORIGIN/{rel}'
+    return {'path': path, 'origin': origin, 'ld_library_path': d, 'rpath': rpath,
+            'candidates': [c[0] for c in found]}
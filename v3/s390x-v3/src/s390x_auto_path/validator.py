@@ -1,32 +1,184 @@
-import subprocess, zipfile, tempfile
+import os, time, zipfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import cache, elf, fsindex, output, profiling, soindex
+
+def _read_wheel_elves(whl):
+    """Parse the ELF headers of a wheel's shared objects straight from the archive.
+    Keys are virtual paths under the wheel (`/path/x.whl/pkg/lib/libfoo.so`); non-ELF
+    members map to None."""
+    root = os.path.abspath(str(whl))
+    overlay = {}
+    with zipfile.ZipFile(str(whl)) as zf:
+        for zi in zf.infolist():
+            if zi.is_dir() or not fsindex.is_so(zi.filename.rsplit('/', 1)[-1]):
+                continue
+            with zf.open(zi) as f:
+                try:
+                    info = elf.parse_stream(f)
+                except elf.ElfError:
+                    info = None
+            overlay[os.path.normpath(os.path.join(root, zi.filename))] = info
+    return overlay
+
+def _stat_sig(path):
+    try:
+        st = os.stat(str(path))
+    except OSError:
+        return ''
+    return f'{st.st_size}:{st.st_mtime_ns}'
+
+def _deps(so, sysroot='', overlay=None, ld_library_path=None):
+    if overlay is not None and overlay.get(so) is None:
+        return []
+    try:
+        return [list(d) for d in elf.resolve_deps(str(so), sysroot=sysroot, ld_library_path=ld_library_path, overlay=overlay)]
+    except (OSError, elf.ElfError):
+        return []  # not an ELF object (linker script, data file, broken link)
+
+def _issues(so, deps, sysroot=''):
+    found = []
+    missing = [name for name, path in deps if path is None]
+    if missing:
+        found.append(f"[MISSING] {so} -> {', '.join(missing)} not found")
+    for name, libpath in deps:
+        if libpath and libpath[len(sysroot):].startswith('/lib/'):
+            found.append(f'[WARN] {so} links to non-lib64: {libpath}')
+    return found
+
+def _issue_records(deps, sysroot='', fixes=None):
+    """The issues of _issues() as typed records: kind 'missing' (with a proposed `fix`
+    when the soname index knows a provider) or 'non_lib64'."""
+    fixes = fixes or {}
+    found = [{'kind': 'missing', 'soname': name, 'path': None, 'fix': fixes.get(name)} for name, path in deps if path is None]
+    found += [{'kind': 'non_lib64', 'soname': name, 'path': path} for name, path in deps
+              if path and path[len(sysroot):].startswith('/lib/')]
+    return found
+
+def _needed(so, overlay=None):
+    try:
+        info = elf.lookup(so, overlay)
+    except (OSError, elf.ElfError):
+        info = None
+    return list(info['needed']) if info else []
+
+def _record(target, so, deps, seconds, cached, sysroot, overlay, fixes=None, key=None):
+    return {'type': 'so', 'target': str(target), 'file': so, 'needed': _needed(key or so, overlay),
+            'deps': [{'soname': name, 'path': path} for name, path in deps],
+            'issues': _issue_records(deps, sysroot, fixes), 'cached': cached, 'seconds': round(seconds, 6)}
+
+def _fixes(so, deps, libs, overlay):
+    missing = [name for name, path in deps if path is None]
+    if not missing:
+        return {}
+    try:
+        ref = elf.lookup(so, overlay)
+    except (OSError, elf.ElfError):
+        ref = None
+    return {name: soindex.suggest(libs, name, so, ref) for name in missing}
+
+@profiling.phase('run_validate')
+def run_validate(target, use_cache=False, jobs=None, sysroot='', ld_library_path=None, suggest=False):
+    """Check every .so under `target` on `jobs` worker threads (default: CPU count).
+    Dependencies are read from the ELF dynamic section and resolved in-process (see
+    elf.resolve_deps), optionally against `sysroot`, so foreign-arch wheels can be checked.
+    `ld_library_path` defaults to $LD_LIBRARY_PATH (the daemon passes the client's).
+    With `use_cache`, only the parsed ELF facts of the target's own files (class, machine,
+    NEEDED, RPATH/RUNPATH) are persisted, keyed by each file's size and mtime (a wheel's
+    own stat for its members); dependencies are resolved again on every run, so libraries
+    added to or removed from the search path are always noticed.
+    With `suggest`, missing sonames are looked up in the persisted soname index (system
+    dirs, ld.so.conf, scanned packages' lib dirs and the target itself) and a provider plus
+    the LD_LIBRARY_PATH / RUNPATH entry that would satisfy it are reported.
+    Results are reported in sorted path order regardless of completion order, except in
+    ndjson output mode, where each .so's record is emitted as soon as it is checked.
+    Returns the number of issues found."""
+    src = Path(target)
+    is_whl = src.suffix == '.whl'
+    root = os.path.abspath(str(src))
+    if ld_library_path is None:
+        ld_library_path = os.environ.get('LD_LIBRARY_PATH', '')
+    print(f'[INFO] validating: {src}')
+    workers = jobs or os.cpu_count() or 1
+    # overlay: {absolute path: parsed ELF info or None} for every .so of the target; the
+    # resolver consults it before the disk, for the files themselves and for deps inside
+    # the target
+    hits = set()
+    if is_whl:
+        # wheel members are inspected in the archive; nothing is extracted
+        fp = _stat_sig(src)
+        overlay = cache.get('elf', root, fp) if use_cache else None
+        if overlay is None:
+            overlay = _read_wheel_elves(src)
+            if use_cache:
+                cache.put('elf', root, fp, overlay)
+        else:
+            hits.update(overlay)
+        base = root
+        sos = sorted(overlay)
+        keys = {so: so for so in sos}
+    else:
+        base = str(src)
+        sos = sorted(str(so) for so in src.rglob('*.so*'))
+        keys = {so: os.path.normpath(os.path.abspath(so)) for so in sos}
+        facts = (cache.get('elf', root, 'dir') or {}) if use_cache else {}
+
+        def parse(so):
+            rel, sig = os.path.relpath(so, base), _stat_sig(so)
+            hit = facts.get(rel)
+            if hit and hit[0] == sig:
+                return so, rel, sig, hit[1], True
+            return so, rel, sig, elf.read_cached(so), False
+
+        overlay, fresh = {}, {}
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for so, rel, sig, info, is_hit in ex.map(parse, sos):
+                overlay[keys[so]] = info
+                fresh[rel] = [sig, info]
+                if is_hit:
+                    hits.add(keys[so])
+        if use_cache and fresh != facts:
+            cache.put('elf', root, 'dir', fresh)
+    profiling.count('files_visited', len(sos))
+
+    # decided here: check() runs on pool threads, which do not see this thread's capture()
+    structured = output.structured()
+    libs = None
+    if suggest:
+        libs = soindex.with_files(soindex.load(sysroot, use_cache=use_cache), overlay)
+
+    def check(so):
+        start = time.perf_counter()
+        key = keys[so]
+        deps = _deps(key, sysroot, overlay, ld_library_path)
+        fixes = _fixes(key, deps, libs, overlay) if libs is not None else {}
+        rec = _record(src, so, deps, time.perf_counter() - start, key in hits, sysroot, overlay, fixes, key) \
+            if structured else None
+        return so, deps, rec, fixes
 
-def _extract_if_wheel(target):
-    p = Path(target)
-    if p.suffix == '.whl':
-        tmp = Path(tempfile.mkdtemp(prefix='s390x_validate_'))
-        with zipfile.ZipFile(str(p),'r') as zf:
-            zf.extractall(tmp)
-        return tmp
-    return p
-
-def run_validate(target):
-    base = _extract_if_wheel(target)
-    print(f'[INFO] validating: {base}')
     issues = 0
-    for so in base.rglob('*.so*'):
-        try:
-            out = subprocess.check_output(['ldd', str(so)], stderr=subprocess.STDOUT, text=True)
-        except subprocess.CalledProcessError as e:
-            out = e.output
-        if 'not found' in out:
-            print(f'[MISSING] {so} -> {out.strip()}'); issues += 1
-        for line in out.splitlines():
-            if '=>' in line:
-                parts = line.split('=>',1)[1].strip().split()
-                if parts:
-                    libpath = parts[0]
-                    if libpath.startswith('/lib/') and not libpath.startswith('/lib64/'):
-                        print(f'[WARN] {so} links to non-lib64: {libpath}'); issues += 1
+    lib_dirs = []
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        if output.current() == 'ndjson':
+            done = (f.result() for f in as_completed([ex.submit(check, so) for so in sos]))
+        else:
+            # map() yields in submission order, so output stays deterministic
+            done = ex.map(check, sos)
+        for so, deps, rec, fixes in done:
+            if rec is not None:
+                output.emit(rec)
+            for msg in _issues(so, deps, sysroot):
+                print(msg); issues += 1
+            for name, fix in sorted(fixes.items()):
+                if fix is None:
+                    print(f'[FIX] {so}: no provider of {name} in the soname index')
+                    continue
+                print(f"[FIX] {so}: {name} -> {fix['path']} ({fix['origin']}); "
+                      f"add {fix['ld_library_path']} to LD_LIBRARY_PATH or RUNPATH {fix['rpath']}")
+                if fix['ld_library_path'] not in lib_dirs:
+                    lib_dirs.append(fix['ld_library_path'])
+    if lib_dirs:
+        print(f"[RESULT] suggested LD_LIBRARY_PATH={':'.join(lib_dirs)}")
     if issues==0: print('[OK] No obvious issues')
     else: print(f'[RESULT] {issues} issues detected')
+    return issues
@@ -0,0 +1,162 @@
+import ctypes
+import ctypes.util
+import importlib
+import os
+import select
+import struct
+import sys
+import sysconfig
+import time
+from . import cache, envgen, resolver
+
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; the name follows
+
+def default_site():
+    return sysconfig.get_paths()['purelib']
+
+def dist_name(entry):
+    """Normalized distribution name of a `name-version.dist-info` entry, else None."""
+    if not entry.endswith('.dist-info'):
+        return None
+    return resolver.normalize_name(entry[:-len('.dist-info')].split('-', 1)[0])
+
+def _snapshot(site):
+    out = {}
+    try:
+        with os.scandir(site) as it:
+            for e in it:
+                if e.name.endswith('.dist-info'):
+                    try:
+                        out[e.name] = e.stat().st_mtime_ns
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+    return out
+
+def _open_inotify(site):
+    """inotify fd watching `site` for dist-info dirs coming and going, or None where
+    inotify is unavailable (non-Linux, no libc, watch limit reached)."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(site), IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def _read_inotify(fd, timeout):
+    """dist-info entry names touched within `timeout` seconds."""
+    names = set()
+    if not select.select([fd], [], [], timeout)[0]:
+        return names
+    try:
+        buf = os.read(fd, 65536)
+    except BlockingIOError:
+        return names
+    pos = 0
+    while pos + _EVENT.size <= len(buf):
+        _, _, _, length = _EVENT.unpack_from(buf, pos)
+        name = buf[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0').decode('utf-8', 'replace')
+        pos += _EVENT.size + length
+        if name.endswith('.dist-info'):
+            names.add(name)
+    return names
+
+def _changes(site, fd, last, timeout):
+    """Entries changed since `last` (polling) or reported by inotify; returns (names, snapshot)."""
+    if fd is not None:
+        return _read_inotify(fd, timeout), last
+    time.sleep(timeout)
+    now = _snapshot(site)
+    return set(k for k in set(now) | set(last) if now.get(k) != last.get(k)), now
+
+def _refresh(state, packages, changed, rewrite_cmake, relocate):
+    """Re-resolve every watched name (metadata only) and rescan just the packages whose
+    location or fingerprint moved. Returns the names rescanned."""
+    importlib.invalidate_caches()
+    resolved = resolver.resolve_packages(packages)
+    touched = []
+    for pkg in packages:
+        base, old = resolved[pkg], state.get(pkg)
+        fp = cache.fingerprint(base) if base else None
+        if old and old['base'] == base and (fp is not None and old['fp'] == fp
+                                            or fp is None and resolver.normalize_name(pkg) not in changed):
+            continue
+        if base is None:
+            if old and old['base'] is not None:
+                print(f'[WARN] package removed: {pkg}')
+                state[pkg] = {'base': None, 'fp': None, 'scan': None}
+                touched.append(pkg)
+            continue
+        scan = envgen.scan_package(base, rewrite_cmake=rewrite_cmake, relocate=relocate)
+        # fingerprint after fixing, like env generate, so the scan cache stays valid
+        fp = cache.fingerprint(base)
+        if fp:
+            cache.put('env', str(base), fp, scan)
+        state[pkg] = {'base': base, 'fp': fp, 'scan': scan}
+        print(f'[OK] refreshed {pkg}: {base}')
+        touched.append(pkg)
+    return touched
+
+def _write(out, packages, state):
+    scans = [state[p]['scan'] for p in packages if state.get(p) and state[p]['scan']]
+    envgen.write_shell(out, envgen.build_env_flags(envgen.merge_scans(scans)))
+
+def watch(out, packages, site=None, rewrite_cmake=False, relocate=(), interval=1.0, settle=0.5,
+          use_inotify=True, stop=None):
+    """Keep `out` (a build_env.sh) current while packages are installed into `site`.
+
+    The initial env is generated like `env generate`. After that, each burst of
+    dist-info changes (debounced by `settle` seconds) re-fixes only the affected packages
+    and rewrites `out` from the in-memory scans of the others. Runs until `stop` (a
+    threading.Event) is set or Ctrl-C."""
+    site = os.path.abspath(site or default_site())
+    if site not in sys.path:
+        sys.path.insert(0, site)
+    # start watching before the initial scan, so an install racing with it is not missed
+    fd = _open_inotify(site) if use_inotify else None
+    last = _snapshot(site)
+    state = {}
+    resolved = resolver.resolve_packages(packages)
+    for pkg in packages:
+        base = resolved[pkg]
+        if not base:
+            print(f"[WARN] package not found: {pkg}")
+            state[pkg] = {'base': None, 'fp': None, 'scan': None}
+            continue
+        state[pkg] = {'base': base, 'fp': None, 'scan': envgen.cached_scan(base)}
+        state[pkg]['fp'] = cache.fingerprint(base)
+    _write(out, packages, state)
+    print(f"[INFO] watching {site} ({'inotify' if fd is not None else f'polling every {interval}s'})", flush=True)
+    try:
+        while stop is None or not stop.is_set():
+            names, last = _changes(site, fd, last, interval)
+            if not names:
+                continue
+            while True:  # pip touches several entries per install; wait for it to settle
+                more, last = _changes(site, fd, last, settle)
+                if not more:
+                    break
+                names |= more
+            changed = set(filter(None, map(dist_name, names)))
+            if _refresh(state, packages, changed, rewrite_cmake, relocate):
+                _write(out, packages, state)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fd is not None:
+            os.close(fd)
@@ -0,0 +1,168 @@
+import base64
+import copy
+import csv
+import hashlib
+import io
+import os
+import struct
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from . import profiling
+
+def clone_info(zi, name=None):
+    """Fresh ZipInfo carrying over `zi`'s timestamp and permissions, optionally renamed."""
+    new = zipfile.ZipInfo(name or zi.filename, zi.date_time)
+    new.create_system = zi.create_system
+    new.external_attr = zi.external_attr
+    new.compress_type = zipfile.ZIP_DEFLATED
+    return new
+
+def _new_info(name):
+    new = zipfile.ZipInfo(name, time.localtime()[:6])
+    new.external_attr = 0o644 << 16
+    new.compress_type = zipfile.ZIP_DEFLATED
+    return new
+
+def extract_members(zf, names, dest):
+    """Extract only `names` from the open ZipFile `zf` under `dest`; returns their paths."""
+    return [Path(zf.extract(n, str(dest))) for n in names]
+
+def record_hash(data):
+    return 'sha256=' + base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode()
+
+def find_record(names):
+    for n in names:
+        parts = n.split('/')
+        if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'RECORD':
+            return n
+    return None
+
+def update_record(text, entries, removed=()):
+    """Rewrite RECORD csv `text`: rows in `entries` ({name: (hash, size)}) are replaced or
+    appended, rows in `removed` dropped. The RECORD's own row stays last."""
+    rows, own = [], None
+    for row in csv.reader(io.StringIO(text)):
+        if not row or row[0] in removed:
+            continue
+        if row[0] in entries:
+            h, size = entries[row[0]]
+            row = [row[0], h, str(size)]
+        if row[0].endswith('.dist-info/RECORD'):
+            own = row
+            continue
+        rows.append(row)
+    have = set(r[0] for r in rows)
+    for name in sorted(set(entries) - have):
+        if own is None or name != own[0]:
+            h, size = entries[name]
+            rows.append([name, h, str(size)])
+    if own is not None:
+        rows.append(own)
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerows(rows)
+    return buf.getvalue()
+
+def _record_rows(zin, record_name):
+    if record_name is None:
+        return {}
+    text = zin.read(record_name).decode('utf-8')
+    return {r[0]: (r[1], r[2]) for r in csv.reader(io.StringIO(text)) if len(r) >= 3 and r[1]}
+
+def copy_raw(zin, zi, zout, name=None):
+    """Append member `zi` of `zin` to `zout` by copying its compressed bytes verbatim.
+
+    Falls back to a decompress/recompress for zip64 and encrypted members."""
+    if zi.flag_bits & 0x1 or zi.file_size >= zipfile.ZIP64_LIMIT or zi.compress_size >= zipfile.ZIP64_LIMIT:
+        zout.writestr(clone_info(zi, name), zin.read(zi))
+        return
+    zin.fp.seek(zi.header_offset)
+    header = zin.fp.read(zipfile.sizeFileHeader)
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    zin.fp.seek(zi.header_offset + zipfile.sizeFileHeader + fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH])
+    raw = zin.fp.read(zi.compress_size)
+    new = copy.copy(zi)
+    if name:
+        new.filename = new.orig_filename = name
+    new.flag_bits &= ~0x08  # sizes/CRC go in the local header, no data descriptor
+    new.extra = b''
+    new.header_offset = zout.fp.tell()
+    if hasattr(new, '_end_offset'):
+        new._end_offset = None
+    zout.fp.write(new.FileHeader(False))
+    zout.fp.write(raw)
+    zout.filelist.append(new)
+    zout.NameToInfo[new.filename] = new
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+@profiling.phase('rewrite_wheel')
+def rewrite_wheel(whl, changed=None, copies=None, removed=()):
+    """Rewrite `whl` in place. `changed` maps member names to new bytes (names not in the
+    archive are added), `copies` maps new member names to the existing member they
+    duplicate, `removed` lists members to drop.
+
+    Only changed and added entries are compressed; every other member's compressed bytes
+    are copied as-is. The dist-info RECORD is updated for everything that changed.
+    Returns False without touching the file when there is nothing to do."""
+    changed = dict(changed or {})
+    copies = copies or {}
+    removed = set(removed)
+    if not changed and not copies and not removed:
+        return False
+    out = Path(whl)
+    tmpname = out.parent / (out.name + '.fixed')
+    try:
+        with zipfile.ZipFile(str(out)) as zin, zipfile.ZipFile(str(tmpname), 'w', compression=zipfile.ZIP_DEFLATED) as zout:
+            names = set(zin.namelist())
+            record_name = find_record(zin.namelist())
+            if record_name:
+                rows = _record_rows(zin, record_name)
+                entries = {n: (record_hash(d), len(d)) for n, d in changed.items() if n != record_name}
+                for n, src in copies.items():
+                    entries[n] = rows.get(src) or (record_hash(zin.read(src)), zin.getinfo(src).file_size)
+                base_text = changed.pop(record_name, None)
+                if base_text is None:
+                    base_text = zin.read(record_name)
+                changed[record_name] = update_record(base_text.decode('utf-8'), entries, removed).encode('utf-8')
+            for zi in zin.infolist():
+                if zi.filename in removed or zi.filename == record_name:
+                    continue
+                if zi.filename in changed:
+                    zout.writestr(clone_info(zi), changed[zi.filename])
+                else:
+                    copy_raw(zin, zi, zout)
+            for name, src in sorted(copies.items()):
+                copy_raw(zin, zin.getinfo(src), zout, name)
+            for name in sorted(set(changed) - names):
+                zout.writestr(_new_info(name), changed[name])
+            if record_name:
+                # RECORD goes last, as wheel installers expect
+                zout.writestr(clone_info(zin.getinfo(record_name)), changed[record_name])
+        profiling.count('bytes_read', out.stat().st_size)
+        profiling.count('bytes_written', tmpname.stat().st_size)
+        os.replace(str(tmpname), str(out))
+    finally:
+        if tmpname.exists():
+            tmpname.unlink()
+    return True
+
+def diff_extracted(extracted_dir, whl):
+    """Compare an extracted tree against the wheel it came from.
+    Returns (changed {name: bytes}, removed [names]); unchanged files are matched on size+CRC."""
+    base = Path(extracted_dir)
+    changed, seen = {}, set()
+    with zipfile.ZipFile(str(whl)) as zf:
+        infos = {zi.filename: zi for zi in zf.infolist() if not zi.is_dir()}
+    for f in sorted(base.rglob('*')):
+        if not f.is_file():
+            continue
+        arc = f.relative_to(base).as_posix()
+        seen.add(arc)
+        data = f.read_bytes()
+        zi = infos.get(arc)
+        if zi is not None and zi.file_size == len(data) and zi.CRC == (zlib.crc32(data) & 0xffffffff):
+            continue
+        changed[arc] = data
+    return changed, sorted(set(infos) - seen)
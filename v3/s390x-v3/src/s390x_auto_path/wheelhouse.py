@@ -0,0 +1,95 @@
+import glob
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_NAME = '.s390x-auto-path-manifest.json'
+
+def is_wheelhouse(path):
+    """A directory of wheels, as opposed to an installed package tree with lib/lib64 dirs."""
+    p = Path(path)
+    if not p.is_dir() or (p / 'lib').is_dir() or (p / 'lib64').is_dir():
+        return False
+    return any(p.glob('*.whl'))
+
+def expand_targets(targets):
+    """Expand wheelhouse dirs and (quoted) glob patterns into individual targets."""
+    out = []
+    for t in targets:
+        if is_wheelhouse(t):
+            out.extend(sorted(str(w) for w in Path(t).glob('*.whl')))
+        elif not os.path.exists(t) and glob.has_magic(t):
+            out.extend(sorted(glob.glob(t)))
+        else:
+            out.append(t)
+    return out
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(str(directory), MANIFEST_NAME)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def save_manifest(directory, manifest):
+    path = os.path.join(str(directory), MANIFEST_NAME)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def is_current(path, options, manifest):
+    """True when `path` was already fixed with `options`. The recorded size/mtime is
+    trusted first; otherwise the content hash decides (e.g. after a copy or touch)."""
+    entry = manifest.get(os.path.basename(path))
+    if not entry or entry.get('options') != options:
+        return False
+    try:
+        if entry.get('stat') == _stat_key(path):
+            return True
+        return entry.get('sha256') == file_sha256(path)
+    except OSError:
+        return False
+
+def record(path, options, manifest):
+    manifest[os.path.basename(path)] = {'sha256': file_sha256(path), 'stat': _stat_key(path), 'options': options}
+
+def partition(wheels, options, force=False):
+    """Split wheel targets into (todo, skipped) using each wheel's directory manifest."""
+    manifests, todo, skipped = {}, [], []
+    for w in wheels:
+        d = os.path.dirname(os.path.abspath(w))
+        if d not in manifests:
+            manifests[d] = load_manifest(d)
+        if not force and is_current(w, options, manifests[d]):
+            skipped.append(w)
+        else:
+            todo.append(w)
+    return todo, skipped
+
+def update(wheels, options):
+    """Record the post-fix hash of each wheel in its directory's manifest."""
+    by_dir = {}
+    for w in wheels:
+        by_dir.setdefault(os.path.dirname(os.path.abspath(w)), []).append(w)
+    for d, ws in by_dir.items():
+        manifest = load_manifest(d)
+        for w in ws:
+            try:
+                record(w, options, manifest)
+            except OSError:
+                continue
+        save_manifest(d, manifest)
@@ -1,3 +1,848 @@
+import os
+
+import pytest
+
+
 def test_import():
     import s390x_auto_path
     assert hasattr(s390x_auto_path, '__version__')
+
+
+def _fake_dist(site, dist, top, version='1.0'):
+    info = site / f"{dist.replace('-', '_')}-{version}.dist-info"
+    info.mkdir(parents=True)
+    (info / 'METADATA').write_text(f'Metadata-Version: 2.1\nName: {dist}\nVersion: {version}\n')
+    (site / top).mkdir()
+    (site / top / '__init__.py').write_text('')
+    (info / 'RECORD').write_text(f'{top}/__init__.py,,\n{info.name}/METADATA,,\n')
+
+
+def test_resolver_dist_and_import_names(tmp_path, monkeypatch):
+    from s390x_auto_path import resolver
+    _fake_dist(tmp_path, 'fake-aws-lc', 'fake_aws_lc')
+    _fake_dist(tmp_path, 'fake-dist-name', 'fakeimp')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    got = resolver.resolve_packages(['fake-aws-lc', 'fake-dist-name', 'fakeimp', 'no-such-pkg-xyz'])
+    assert got['fake-aws-lc'] == tmp_path / 'fake_aws_lc'
+    assert got['fake-dist-name'] == tmp_path / 'fakeimp'
+    assert got['fakeimp'] == tmp_path / 'fakeimp'
+    assert got['no-such-pkg-xyz'] is None
+
+
+def _make_pkg(base):
+    for d in ['include/aws/common/posix', 'lib/pkgconfig', 'lib/crypto/cmake', 'wheel_payload/lib64/aws-c-common/cmake']:
+        (base / d).mkdir(parents=True)
+    (base / 'lib' / 'libcrypto.so.1').write_bytes(b'')
+    (base / 'lib' / 'crypto' / 'cmake' / 'crypto-config.cmake').write_text('set(X /lib/)\n')
+    return base
+
+
+def test_layout_and_scans_share_one_index(tmp_path):
+    from s390x_auto_path import libfix, fsindex
+    base = _make_pkg(tmp_path / 'pkg')
+    index = fsindex.index_tree(base)
+    libfix.fix_lib_layout(base, index=index)
+    assert (base / 'lib64' / 'libcrypto.so.1').is_symlink()
+    parts = libfix.find_subdirs(base, index=index)
+    assert str(base / 'lib64') in parts['lib64']
+    assert str(base / 'include' / 'aws' / 'common' / 'posix') in parts['include']
+    fresh = libfix.find_subdirs(base)
+    assert {k: sorted(v) for k, v in parts.items()} == {k: sorted(v) for k, v in fresh.items()}
+    deep = libfix.find_deep_cmake_dirs_from_packages([base], indexes={str(base): index})
+    assert sorted(deep) == [str(base / 'lib/crypto/cmake'), str(base / 'wheel_payload/lib64/aws-c-common/cmake')]
+
+
+def test_cache_fingerprint_and_lru(tmp_path, monkeypatch):
+    from s390x_auto_path import cache
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    monkeypatch.setenv('S390X_AUTO_PATH_CACHE_MAX', '2')
+    site = tmp_path / 'site'
+    _fake_dist(site, 'fake-aws-lc', 'fake_aws_lc')
+    base = site / 'fake_aws_lc'
+    fp = cache.fingerprint(base)
+    cache.put('env', str(base), fp, {'cmake': ['x']})
+    assert cache.get('env', str(base), fp) == {'cmake': ['x']}
+    (site / 'fake_aws_lc-1.0.dist-info' / 'RECORD').write_text('changed\n')
+    assert cache.fingerprint(base) != fp
+    cache.put('a', '1', 'fp', 1)
+    cache.put('b', '2', 'fp', 2)
+    assert sorted(p.name.split('-')[0] for p in cache.cache_dir().glob('*.json')) == ['a', 'b']
+    assert cache.values('a') == [('1', 1)]  # found by file name, other kinds are not parsed
+    real_scandir = os.scandir
+
+    def racing_scandir(path):  # another process evicts an entry between listing and stat
+        entries = list(real_scandir(path))
+        os.unlink(entries[0].path)
+        return iter(entries)
+    monkeypatch.setattr(cache.os, 'scandir', racing_scandir)
+    cache.put('c', '3', 'fp', 3)
+    monkeypatch.setattr(cache.os, 'scandir', real_scandir)
+    assert len(list(cache.cache_dir().glob('*.json'))) == 2
+    assert cache.clear() == 2
+
+
+def test_validate_parallel_is_ordered(tmp_path, monkeypatch, capsys):
+    import time
+    from s390x_auto_path import validator
+    names = ['liba.so', 'libb.so.1', 'libc.so']
+    for i, n in enumerate(names):
+        (tmp_path / n).write_bytes(b'')
+    delays = {n: 0.05 * (len(names) - i) for i, n in enumerate(names)}
+
+    def fake_deps(so, sysroot='', overlay=None, ld_library_path=None):
+        time.sleep(delays[os.path.basename(so)])
+        return [['libz.so.1', None]]
+    monkeypatch.setattr(validator, '_deps', fake_deps)
+    assert validator.run_validate(tmp_path, jobs=3) == 3
+    lines = [l for l in capsys.readouterr().out.splitlines() if l.startswith('[MISSING]')]
+    assert [l.split()[1] for l in lines] == [str(tmp_path / n) for n in names]
+
+
+def test_elf_reader_resolves_interpreter_deps(tmp_path):
+    import os, sys, pytest
+    from s390x_auto_path import elf
+    exe = os.path.realpath(sys.executable)
+    info = elf.read_dynamic(exe)
+    assert info['class'] in (32, 64) and info['endian'] in '<>'
+    deps = dict(elf.resolve_deps(exe))
+    libc = [n for n in deps if n.startswith('libc.so')]
+    assert libc and deps[libc[0]] is not None
+    (tmp_path / 'libfake.so').write_text('INPUT(-lc)\n')
+    with pytest.raises(elf.ElfError):
+        elf.read_dynamic(str(tmp_path / 'libfake.so'))
+
+
+def _dynload_so():
+    import glob, sysconfig
+    found = sorted(glob.glob(os.path.join(sysconfig.get_path('platstdlib'), 'lib-dynload', '*.so')))
+    if not found:
+        pytest.skip('no lib-dynload extension modules to use as ELF fixture')
+    return found[0]
+
+
+def test_fix_wheel_streams_members(tmp_path):
+    import zipfile
+    from s390x_auto_path import libfix
+    whl = tmp_path / 'demo-1.0-py3-none-any.whl'
+    with zipfile.ZipFile(whl, 'w') as zf:
+        zf.writestr('lib/libdemo.so.1', b'\x7fELF-not-really')
+        zf.writestr('lib/cmake/demo-config.cmake', 'set(DEMO_LIB ${PREFIX}/lib/libdemo.so.1)\n')
+        zf.writestr('demo/__init__.py', '')
+    libfix.fix_target(whl, rewrite_cmake=True)
+    with zipfile.ZipFile(whl) as zf:
+        assert zf.read('lib64/libdemo.so.1') == b'\x7fELF-not-really'
+        assert '/lib64/' in zf.read('lib/cmake/demo-config.cmake').decode()
+    mtime = whl.stat().st_mtime_ns
+    libfix.fix_target(whl)
+    assert whl.stat().st_mtime_ns == mtime  # nothing left to change: archive untouched
+
+
+def test_validate_wheel_without_extracting(tmp_path, monkeypatch, capsys):
+    import zipfile
+    from s390x_auto_path import validator
+    so = _dynload_so()
+    whl = tmp_path / 'demo-1.0-cp311-linux.whl'
+    with zipfile.ZipFile(whl, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(so, 'demo/_ext.so')
+        zf.writestr('demo/libnot.so', 'INPUT(-lc)')
+    monkeypatch.setattr(zipfile.ZipFile, 'extractall', None)
+    validator.run_validate(whl)
+    out = capsys.readouterr().out
+    assert '[MISSING]' not in out
+
+
+def _assert_record_matches(whl):
+    import csv, io, zipfile
+    from s390x_auto_path import wheel
+    with zipfile.ZipFile(whl) as zf:
+        assert zf.testzip() is None
+        rows = list(csv.reader(io.StringIO(zf.read('demo-1.0.dist-info/RECORD').decode())))
+        listed = {r[0] for r in rows}
+        assert listed == set(zf.namelist())
+        for name, h, size in rows:
+            if h:
+                data = zf.read(name)
+                assert (h, int(size)) == (wheel.record_hash(data), len(data)), name
+    return rows
+
+
+def test_incremental_repack_copies_raw_and_fixes_record(tmp_path):
+    import zipfile
+    from s390x_auto_path import libfix, wheel
+    whl = tmp_path / 'demo-1.0-py3-none-any.whl'
+    members = {'lib/libdemo.so.1': os.urandom(4096), 'demo/__init__.py': b'x = 1\n' * 100,
+               'lib/cmake/demo-config.cmake': b'set(L ${P}/lib/libdemo.so.1)\n'}
+    record = ''.join(f'{n},{wheel.record_hash(d)},{len(d)}\n' for n, d in members.items())
+    with zipfile.ZipFile(whl, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for n, d in members.items():
+            zf.writestr(n, d)
+        zf.writestr('demo-1.0.dist-info/RECORD', record + 'demo-1.0.dist-info/RECORD,,\n')
+    with zipfile.ZipFile(whl) as zf:
+        before = zf.getinfo('demo/__init__.py')
+    libfix.fix_target(whl, rewrite_cmake=True)
+    rows = _assert_record_matches(whl)
+    assert rows[-1][0] == 'demo-1.0.dist-info/RECORD'
+    with zipfile.ZipFile(whl) as zf:
+        after = zf.getinfo('demo/__init__.py')
+        assert (after.compress_size, after.CRC) == (before.compress_size, before.CRC)
+        assert 'lib64/libdemo.so.1' in zf.namelist()
+    extracted = tmp_path / 'x'
+    with zipfile.ZipFile(whl) as zf:
+        zf.extractall(extracted)
+    (extracted / 'demo' / '__init__.py').write_text('x = 2\n')
+    libfix.repack_wheel(extracted, whl)
+    _assert_record_matches(whl)
+
+
+def _fake_tool(bindir, name, body):
+    bindir.mkdir(exist_ok=True)
+    tool = bindir / name
+    tool.write_text('#!/bin/sh\n' + body)
+    tool.chmod(0o755)
+    return tool
+
+
+def test_patch_rpath_probes_patchelf_once(tmp_path, monkeypatch):
+    import shutil
+    from s390x_auto_path import libfix
+    so = _dynload_so()
+    for n in ('liba.so', 'libb.so'):
+        shutil.copy(so, tmp_path / n)
+    log = tmp_path / 'calls.log'
+    _fake_tool(tmp_path / 'bin', 'patchelf', f'echo "$1" >> {log}\n')
+    monkeypatch.setenv('PATH', f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+    libfix._has_patchelf.cache_clear()
+    try:
+        # too long for any existing .dynstr slot, so patchelf is needed
+        results = libfix.patch_rpath_target(tmp_path, '/opt/' + 'x' * 512, jobs=2)
+    finally:
+        libfix._has_patchelf.cache_clear()
+    assert results == [('ok', 'patchelf'), ('ok', 'patchelf')]
+    calls = log.read_text().split()
+    assert calls.count('--version') == 1 and calls.count('--set-rpath') == 2
+
+
+def test_runner_times_out_hung_tool_without_blocking_others(tmp_path, monkeypatch):
+    import asyncio
+    import subprocess
+    import time
+    from s390x_auto_path import runner
+    _fake_tool(tmp_path / 'bin', 'slowtool', 'sleep 30\n')
+    _fake_tool(tmp_path / 'bin', 'failtool', 'echo broken; exit 3\n')
+    monkeypatch.setenv('PATH', f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+    start = time.monotonic()
+    res = runner.run_many([['slowtool'], ['echo', 'hi'], ['failtool'], ['echo', 'there']], jobs=2, timeout=0.3)
+    assert time.monotonic() - start < 5
+    assert isinstance(res[0], subprocess.TimeoutExpired)
+    assert res[1]['stdout'] == 'hi\n' and res[3]['stdout'] == 'there\n'
+    assert isinstance(res[2], subprocess.CalledProcessError) and res[2].output == 'broken\n'
+    assert runner.run(['echo', 'x'], retries=0)['attempts'] == 1
+
+    async def from_async_code():  # asyncio.run() cannot nest; the helpers still work
+        return runner.run(['echo', 'y'])['stdout'], runner.run_many([['echo', 'z']])[0]['stdout']
+    assert asyncio.run(from_async_code()) == ('y\n', 'z\n')
+
+
+def test_runner_kills_tool_when_cancelled(tmp_path):
+    import asyncio
+    from s390x_auto_path import runner
+    pidfile = tmp_path / 'pid'
+
+    async def main():
+        task = asyncio.ensure_future(runner.run_async(['sh', '-c', f'echo $$ > {pidfile}; sleep 30']))
+        while not pidfile.exists() or not pidfile.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(main())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pidfile.read_text()), 0)
+
+
+def test_runpath_rewritten_in_place(tmp_path):
+    import shutil
+    from s390x_auto_path import elf, libfix
+    so = str(tmp_path / 'libdemo.so')
+    shutil.copy(_dynload_so(), so)
+    if not elf.read_dynamic(so)['runpath'] and not elf.read_dynamic(so)['rpath']:
+        pytest.skip('fixture has no rpath slot to reuse')
+    assert libfix.patch_rpath_target(tmp_path, '/o') == [('ok', 'in-place')]
+    info = elf.read_dynamic(so)
+    assert info['runpath'] == '/o' and info['rpath'] is None
+    assert elf.set_runpath_inplace(so, '/' + 'x' * 4096) is False
+    # without section headers (sstrip) the names sharing .dynstr are unknown: leave it to patchelf
+    data = bytearray(open(so, 'rb').read())
+    if data[4] == 2:
+        data[40:48] = bytes(8)
+    else:
+        data[32:36] = bytes(4)
+    stripped = tmp_path / 'stripped.so'
+    stripped.write_bytes(bytes(data))
+    assert elf.set_runpath_inplace(str(stripped), '/p') is False and stripped.read_bytes() == data
+
+
+def test_patch_rpath_patches_each_real_file_once(tmp_path):
+    import shutil
+    from s390x_auto_path import libfix
+    (tmp_path / 'lib64').mkdir()
+    shutil.copy(_dynload_so(), str(tmp_path / 'lib64' / 'libfoo.so.1'))
+    os.symlink('libfoo.so.1', str(tmp_path / 'lib64' / 'libfoo.so'))
+    os.symlink('lib64', str(tmp_path / 'lib'))
+    (tmp_path / 'compat').mkdir()
+    os.link(str(tmp_path / 'lib64' / 'libfoo.so.1'), str(tmp_path / 'compat' / 'libfoo.so.1'))
+    os.symlink(str(tmp_path / 'lib64' / 'libfoo.so.1'), str(tmp_path / 'compat' / 'libfoo.so'))
+    results = libfix.patch_rpath_target(tmp_path, '/o', jobs=4)
+    assert len(results) == 1  # one file, whatever names reach it
+
+def test_sitecustomize_has_precomputed_libdir(tmp_path):
+    import subprocess, sys, sysconfig
+    from s390x_auto_path import libfix
+    (tmp_path / 'usr' / 'lib64').mkdir(parents=True)
+    (tmp_path / 'usr' / 'lib').mkdir()
+    (tmp_path / 'usr' / 'lib64' / 'libpython3.so').write_bytes(b'')
+    assert libfix.detect_libdir(str(tmp_path / 'usr' / 'lib')) == str(tmp_path / 'usr' / 'lib64')
+    venv = tmp_path / 'venv'
+    subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip', str(venv)])
+    libfix.inject_sitecustomize_into_venv(venv)
+    site = next(venv.glob('lib*/python*/site-packages/sitecustomize.py'))
+    text = site.read_text()
+    assert 'glob' not in text and 'LIBDIR = ' in text
+    out = subprocess.check_output([str(venv / 'bin' / 'python'), '-c', 'import os, sysconfig; print(os.environ["LIBDIR"] == sysconfig.get_config_var("LIBDIR"))'], text=True)
+    assert out.strip() == 'True'
+    assert libfix.detect_libdir(str(tmp_path / 'usr' / 'lib64')) == str(tmp_path / 'usr' / 'lib64')
+    # a stale injection (the layout changed since) is replaced by the real LIBDIR on refresh
+    site.write_text(libfix.SITE_CUSTOMIZE.format(libdir=str(tmp_path / 'usr' / 'lib')))
+    libfix.inject_sitecustomize_into_venv(venv, refresh=True)
+    real = libfix.detect_libdir(sysconfig.get_config_var('LIBDIR') or '/usr/lib')
+    assert f'LIBDIR = {real!r}' in site.read_text()
+
+
+def test_rewrite_cmake_and_pkgconfig_rules(tmp_path):
+    from s390x_auto_path import libfix
+    base = tmp_path / 'pkg'
+    (base / 'lib' / 'pkgconfig').mkdir(parents=True)
+    (base / 'lib64').mkdir()
+    (base / 'lib' / 'pkgconfig' / 'demo.pc').write_text('prefix=/build/install\nlibdir=${prefix}/lib\n')
+    cfg = base / 'lib' / 'demo-config.cmake'
+    cfg.write_text('set_target_properties(d PROPERTIES INTERFACE_LINK_DIRECTORIES "${_IMPORT_PREFIX}/lib")\n')
+    done = base / 'lib' / 'done-config.cmake'
+    done.write_text('set(A /x/lib64/liba.so)\nset(B /x/lib/libb.so)\n')
+    os.symlink('demo.pc', str(base / 'lib' / 'pkgconfig' / 'alias.pc'))
+    (tmp_path / 'shared').mkdir()
+    (tmp_path / 'shared' / 'shared-config.cmake').write_text('set(S "${_IMPORT_PREFIX}/lib")\n')
+    os.symlink(str(tmp_path / 'shared' / 'shared-config.cmake'), str(base / 'lib' / 'shared-config.cmake'))
+    stats = libfix.rewrite_cmake_paths(base, relocate=[('/build/install', '/opt/demo')])
+    assert (base / 'lib' / 'pkgconfig' / 'demo.pc').read_text() == 'prefix=/opt/demo\nlibdir=${prefix}/lib64\n'
+    assert '"${_IMPORT_PREFIX}/lib64"' in cfg.read_text()
+    assert '/x/lib/libb.so' in done.read_text()  # files already on lib64 are left alone
+    # symlinked files: the target is rewritten (once) and the links stay links
+    assert os.path.islink(str(base / 'lib' / 'pkgconfig' / 'alias.pc'))
+    assert os.path.islink(str(base / 'lib' / 'shared-config.cmake'))
+    assert (tmp_path / 'shared' / 'shared-config.cmake').read_text() == 'set(S "${_IMPORT_PREFIX}/lib64")\n'
+    assert (stats['files'], stats['files_changed']) == (4, 3) and stats['bytes_scanned'] > 0
+
+
+def test_fix_targets_in_process_pool_isolates_failures(tmp_path, capsys):
+    import zipfile
+    from s390x_auto_path import batch, libfix
+    good = []
+    for i in range(3):
+        whl = tmp_path / f'demo{i}-1.0-py3-none-any.whl'
+        with zipfile.ZipFile(whl, 'w') as zf:
+            zf.writestr('lib/libdemo.so', b'')
+        good.append(str(whl))
+    bad = tmp_path / 'broken-1.0-py3-none-any.whl'
+    bad.write_bytes(b'not a zip')
+    results = batch.run_targets(libfix.fix_target, good + [str(bad)], procs=2)
+    assert [r['ok'] for r in results] == [True, True, True, False]
+    assert batch.print_summary(results) == 1
+    assert 'BadZipFile' in capsys.readouterr().out
+    with zipfile.ZipFile(good[0]) as zf:
+        assert 'lib64/libdemo.so' in zf.namelist()
+
+
+def test_fix_wheelhouse_skips_already_fixed(tmp_path, monkeypatch, capsys):
+    import sys
+    import zipfile
+    from s390x_auto_path import cli, libfix, wheelhouse
+    house = tmp_path / 'house'
+    house.mkdir()
+    for i in range(2):
+        with zipfile.ZipFile(house / f'demo{i}-1.0-py3-none-any.whl', 'w') as zf:
+            zf.writestr('lib/libdemo.so', b'')
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', 'fix', str(house)])
+    cli.main()
+    assert set(wheelhouse.load_manifest(house)) == {'demo0-1.0-py3-none-any.whl', 'demo1-1.0-py3-none-any.whl'}
+    capsys.readouterr()
+    calls = []
+    monkeypatch.setattr(libfix, 'fix_target', lambda t, **kw: calls.append(t))
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', 'fix', str(house / '*.whl')])
+    cli.main()
+    assert calls == [] and capsys.readouterr().out.count('already fixed') == 2
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', 'fix', str(house), '--rewrite-cmake'])
+    cli.main()  # different options: both wheels are fixed again
+    assert len(calls) == 2
+
+
+def test_daemon_serves_scan_env_and_sees_installs(tmp_path, monkeypatch, capsys):
+    import sys
+    import threading
+    import time
+    from s390x_auto_path import daemon
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    site = tmp_path / 'site'
+    site.mkdir()
+    monkeypatch.syspath_prepend(str(site))
+    sock = str(tmp_path / 'd.sock')
+    t = threading.Thread(target=daemon.serve, args=(sock, 0.05), daemon=True)
+    t.start()
+    for _ in range(100):
+        if daemon.request('ping', path=sock, timeout=1):
+            break
+        time.sleep(0.02)
+    assert daemon.request('scan', {'packages': ['fake-aws-lc']}, path=sock)['value'] == {'fake-aws-lc': None}
+    gen = daemon.request('ping', path=sock)['value']['generation']
+    _fake_dist(site, 'fake-aws-lc', 'fake_aws_lc')
+    for _ in range(100):
+        if daemon.request('ping', path=sock)['value']['generation'] > gen:
+            break
+        time.sleep(0.02)
+    assert daemon.request('scan', {'packages': ['fake-aws-lc']}, path=sock)['value'] == {'fake-aws-lc': str(site / 'fake_aws_lc')}
+    out = tmp_path / 'build_env.sh'
+    resp = daemon.request('env', {'out': str(out), 'packages': ['fake-aws-lc']}, path=sock)
+    assert resp['ok'] and out.exists() and '[OK] wrote environment' in resp['output']
+    assert daemon.request('bogus', path=sock)['ok'] is False
+    assert os.stat(sock).st_mode & 0o077 == 0  # owner-only
+    # the CLI forwards only to a daemon of its own version
+    from s390x_auto_path import cli
+    handled, real = [], daemon._handle
+    version = [daemon.__version__]
+
+    def handle(state, cmd, args):
+        handled.append(cmd)
+        value = real(state, cmd, args)
+        return dict(value, version=version[0]) if cmd == 'ping' else value
+    monkeypatch.setattr(daemon, '_handle', handle)
+    monkeypatch.setenv('S390X_AUTO_PATH_SOCKET', sock)
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', 'scan', 'fake-aws-lc'])
+    cli.main()
+    assert handled == ['ping', 'scan']
+    version[0] = '0.0.0'
+    del handled[:]
+    cli.main()
+    assert handled == ['ping'] and '[WARN] daemon' in capsys.readouterr().out
+    daemon.request('shutdown', path=sock)
+    t.join(5)
+    assert not t.is_alive() and not os.path.exists(sock)
+    assert daemon.request('ping', path=sock) is None
+    (tmp_path / 'build_env.sh').write_text('keep\n')
+    with pytest.raises(RuntimeError, match='not a socket'):
+        daemon.serve(str(tmp_path / 'build_env.sh'))
+    assert (tmp_path / 'build_env.sh').read_text() == 'keep\n'
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_watch_refreshes_only_changed_package(tmp_path, monkeypatch, use_inotify):
+    import threading
+    import time
+    from s390x_auto_path import envgen, watch
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    site = tmp_path / 'site'
+    site.mkdir()
+    _fake_dist(site, 'fake-a', 'fake_a')
+    (site / 'fake_a' / 'lib').mkdir()
+    (site / 'fake_a' / 'lib' / 'liba.so').write_bytes(b'')
+    monkeypatch.syspath_prepend(str(site))
+    scanned = []
+    real_scan = envgen.scan_package
+    monkeypatch.setattr(envgen, 'scan_package', lambda base, **kw: scanned.append(base.name) or real_scan(base, **kw))
+    out = tmp_path / 'build_env.sh'
+    stop = threading.Event()
+    t = threading.Thread(target=watch.watch, args=(str(out), ['fake-a', 'fake-b']),
+                         kwargs={'site': str(site), 'interval': 0.05, 'settle': 0.05, 'use_inotify': use_inotify, 'stop': stop})
+    t.start()
+    try:
+        for _ in range(100):
+            if out.exists():
+                break
+            time.sleep(0.02)
+        assert 'fake_b' not in out.read_text() and scanned == ['fake_a']
+        # install like pip: package files first, dist-info last (the watcher keys on dist-info)
+        staging = tmp_path / 'staging'
+        staging.mkdir()
+        _fake_dist(staging, 'fake-b', 'fake_b')
+        (staging / 'fake_b' / 'include').mkdir()
+        os.rename(str(staging / 'fake_b'), str(site / 'fake_b'))
+        os.rename(str(staging / 'fake_b-1.0.dist-info'), str(site / 'fake_b-1.0.dist-info'))
+        for _ in range(200):
+            if 'fake_b' in out.read_text():
+                break
+            time.sleep(0.02)
+        assert str(site / 'fake_b' / 'include') in out.read_text()
+        assert str(site / 'fake_a' / 'lib64') in out.read_text()
+        assert scanned == ['fake_a', 'fake_b']  # fake-a was not rescanned
+    finally:
+        stop.set()
+        t.join(5)
+
+
+def test_bench_harness_smoke(tmp_path):
+    import importlib.util
+    import json
+    path = os.path.join(os.path.dirname(__file__), '..', 'bench', 'bench.py')
+    spec = importlib.util.spec_from_file_location('s390x_bench', path)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    out = tmp_path / 'r.json'
+    bench.main(['--repeat', '1', '--wheel-mb', '1', '--out', str(out)])
+    data = json.loads(out.read_text())
+    assert set(data['results']) == {'find_subdirs', 'fix_lib_layout', 'find_deep_cmake_dirs',
+                                    'rewrite_cmake_paths', 'repack_wheel', 'run_validate'}
+    assert all(r['repeat'] == 1 and r['min'] >= 0 for r in data['results'].values())
+
+
+def test_profiling_collects_phases_from_pool_workers(tmp_path):
+    import json
+    import zipfile
+    from s390x_auto_path import batch, libfix, profiling
+    wheels = []
+    for i in range(2):
+        whl = tmp_path / f'demo{i}-1.0-py3-none-any.whl'
+        with zipfile.ZipFile(whl, 'w') as zf:
+            zf.writestr('lib/libdemo.so', b'')
+            zf.writestr('lib/cmake/demo-config.cmake', 'set(X ${PREFIX}/lib/libdemo.so)\n')
+        wheels.append(str(whl))
+    pkg = _make_pkg(tmp_path / 'pkg')
+    profiling.enable()
+    try:
+        batch.run_targets(libfix.fix_target, wheels, procs=2, rewrite_cmake=True)
+        libfix.fix_target(pkg, rewrite_cmake=True)
+        rows = profiling.summary()
+        profiling.write_trace(str(tmp_path / 'trace.json'))
+    finally:
+        profiling.enable(False)
+    assert rows['fix_target']['calls'] == 2 and rows['fix_wheel']['calls'] == 2
+    assert rows['rewrite_wheel']['bytes_written'] > 0
+    assert rows['index_tree']['files_visited'] >= 10 and rows['rewrite_cmake_paths']['bytes_read'] > 0
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    assert all(ev['ph'] == 'X' and ev['dur'] >= 0 for ev in events)
+    assert len(set(ev['pid'] for ev in events)) >= 2  # worker events were shipped back
+
+
+def _emit_and_wait_for_parent(target, out):
+    import time
+    from s390x_auto_path import output
+    output.emit({'type': 'so', 'file': target})
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:  # the parent writes the record while this worker runs
+        if target in open(out).read():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_ndjson_streams_records_from_pool_workers(tmp_path):
+    import json
+    from s390x_auto_path import batch, output
+    out = tmp_path / 'out.ndjson'
+    with open(str(out), 'w') as stream:
+        output.configure('ndjson', stream=stream)
+        try:
+            results = batch.run_targets(_emit_and_wait_for_parent, ['a', 'b'], procs=2, out=str(out))
+        finally:
+            output.configure('text')
+    assert [r['value'] for r in results] == [True, True]
+    records = [json.loads(line) for line in out.read_text().splitlines()]
+    for t in ('a', 'b'):
+        mine = [i for i, r in enumerate(records) if r.get('file') == t or r.get('target') == t]
+        assert [records[i]['type'] for i in mine] == ['so', 'result']
+
+def test_ndjson_validate_streams_typed_records(tmp_path, monkeypatch, capsys):
+    import json
+    import shutil
+    import sys
+    from s390x_auto_path import cli, output
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    (tmp_path / 'pkg' / 'lib').mkdir(parents=True)
+    shutil.copy(_dynload_so(), str(tmp_path / 'pkg' / 'lib' / 'libdemo.so'))
+    (tmp_path / 'pkg' / 'lib' / 'libnotelf.so').write_text('INPUT(-lc)\n')
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', '--format', 'ndjson', 'validate', str(tmp_path / 'pkg'), '--no-cache'])
+    try:
+        cli.main()
+    finally:
+        output.configure('text')
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert '[INFO] validating' in captured.err and '[INFO]' not in captured.out
+    so = {r['file'].rsplit('/', 1)[-1]: r for r in records if r['type'] == 'so'}
+    assert set(so) == {'libdemo.so', 'libnotelf.so'}
+    assert so['libdemo.so']['needed'] and all({'soname', 'path'} == set(d) for d in so['libdemo.so']['deps'])
+    assert so['libnotelf.so']['needed'] == [] and so['libnotelf.so']['issues'] == []
+    assert all(i['kind'] in ('missing', 'non_lib64') for r in so.values() for i in r['issues'])
+    assert records[-1]['type'] == 'result' and records[-1]['ok'] is True
+
+
+def test_json_format_is_one_document(tmp_path, monkeypatch, capsys):
+    import json
+    import sys
+    from s390x_auto_path import cli, output
+    pkg = _make_pkg(tmp_path / 'pkg')
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', '--format', 'json', 'fix', str(pkg), '--rewrite-cmake'])
+    try:
+        cli.main()
+    finally:
+        output.configure('text')
+    doc = json.loads(capsys.readouterr().out)
+    assert [r['type'] for r in doc] == ['rewrite', 'result']
+    assert doc[0]['files_changed'] == 1 and doc[1]['target'] == str(pkg)
+
+
+def test_soname_index_suggests_provider(tmp_path, monkeypatch, capsys):
+    import shutil
+    from s390x_auto_path import cache, soindex, validator
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    monkeypatch.setenv('LD_LIBRARY_PATH', '')
+    src = _dynload_so()
+    data = open(src, 'rb').read()
+    if b'libc.so.6\0' not in data:
+        pytest.skip('fixture does not link libc.so.6')
+    (tmp_path / 'a' / 'lib').mkdir(parents=True)
+    (tmp_path / 'a' / 'lib' / 'mod.so').write_bytes(data.replace(b'libc.so.6\0', b'libq.so.6\0', 1))
+    (tmp_path / 'b' / 'lib64').mkdir(parents=True)
+    shutil.copy(src, str(tmp_path / 'b' / 'lib64' / 'libq.so.6'))
+    cache.put('env', str(tmp_path / 'b'), 'fp', {'parts': {'lib': [], 'lib64': [str(tmp_path / 'b' / 'lib64')]}, 'cmake': []})
+    libs = soindex.load()
+    assert soindex.lookup(libs, 'libq.so.6')[0][0] == str(tmp_path / 'b' / 'lib64' / 'libq.so.6')
+    assert soindex.load() is libs  # unchanged dirs: memoized, nothing rebuilt
+    validator.run_validate(tmp_path / 'a', suggest=True)
+    out = capsys.readouterr().out
+    assert f"libq.so.6 -> {tmp_path / 'b' / 'lib64' / 'libq.so.6'} (package)" in out
+    assert 'RUNPATH $ORIGIN/../../b/lib64' in out
+    assert f"[RESULT] suggested LD_LIBRARY_PATH={tmp_path / 'b' / 'lib64'}" in out
+    # without the cache the index is rebuilt, not read or written back
+    soindex._memo.clear()
+    kinds = []
+    monkeypatch.setattr(cache, 'get', lambda kind, *a: kinds.append(kind))
+    monkeypatch.setattr(cache, 'put', lambda kind, *a: kinds.append(kind))
+    validator.run_validate(tmp_path / 'a', use_cache=False, suggest=True)
+    assert 'libq.so.6 -> ' in capsys.readouterr().out and 'soindex' not in kinds
+
+
+def test_env_flags_use_minimal_path_set(tmp_path):
+    from s390x_auto_path import envgen, libfix
+    base = _make_pkg(tmp_path / 'pkg')
+    (base / 'include' / 'openssl' / 'experimental').mkdir(parents=True)
+    (base / 'lib' / 'pkgconfig' / 'demo.pc').write_text('Name: demo\n')
+    (base / 'share' / 'pkgconfig').mkdir(parents=True)
+    (base / 'share' / 'cmake').mkdir(parents=True)
+    (base / 'wheel_payload' / 'lib64' / 'aws-c-common' / 'cmake' / 'aws-c-common-config.cmake').write_text('')
+    libfix.fix_lib_layout(base)
+    paths = libfix.find_subdirs(base)
+    paths['cmake'] += libfix.find_deep_cmake_dirs_from_packages([base])
+    assert str(base / 'include' / 'aws' / 'common' / 'posix') in paths['include']
+    small = envgen.minimal_paths(paths)
+    assert small['include'] == [str(base / 'include')]
+    assert small['lib64'] + small['lib'] == [str(base / 'lib64')]  # lib is a mirror of lib64
+    assert small['pkgconfig'] == [str(base / 'lib' / 'pkgconfig')]
+    assert sorted(small['cmake']) == [str(base / 'lib' / 'crypto' / 'cmake'),
+                                      str(base / 'wheel_payload' / 'lib64' / 'aws-c-common' / 'cmake')]
+    env = envgen.build_env_flags(paths)
+    assert env['CFLAGS'] == f"-I{base / 'include'}" and env['LD_LIBRARY_PATH'] == str(base / 'lib64')
+    assert len(envgen.build_env_flags(paths, minimal=False)['CFLAGS']) > len(env['CFLAGS'])
+
+
+def test_minimal_paths_keep_aws_modules_and_package_order(tmp_path):
+    from s390x_auto_path import envgen, libfix
+    # aws-c-common: the Aws*.cmake modules sit in lib64/cmake, the package config one level deeper
+    common = tmp_path / 'aws_c_common' / 'wheel_payload'
+    (common / 'lib64' / 'cmake').mkdir(parents=True)
+    (common / 'lib64' / 'cmake' / 'AwsCFlags.cmake').write_text('')
+    (common / 'lib64' / 'cmake' / 'AwsFindPackage.cmake').write_text('')
+    (common / 'lib64' / 'aws-c-common' / 'cmake').mkdir(parents=True)
+    (common / 'lib64' / 'aws-c-common' / 'cmake' / 'aws-c-common-config.cmake').write_text('')
+    (common / 'lib64' / 'libaws-c-common.so').write_bytes(b'')
+    (tmp_path / 'other' / 'lib').mkdir(parents=True)
+    (tmp_path / 'other' / 'lib' / 'libother.so').write_bytes(b'')
+    (tmp_path / 'last' / 'lib64').mkdir(parents=True)
+    (tmp_path / 'last' / 'lib64' / 'libother.so').write_bytes(b'')
+    scans = [{'parts': libfix.find_subdirs(base), 'cmake': libfix.find_deep_cmake_dirs_from_packages([base])}
+             for base in (common, tmp_path / 'other', tmp_path / 'last')]
+    small = envgen.minimal_paths(envgen.merge_scans(scans))
+    assert sorted(small['cmake']) == [str(common / 'lib64' / 'aws-c-common' / 'cmake'), str(common / 'lib64' / 'cmake')]
+    # lib and lib64 dirs stay in package order, so the first package still wins a library name
+    assert small['lib64'] == [str(common / 'lib64'), str(tmp_path / 'other' / 'lib'), str(tmp_path / 'last' / 'lib64')]
+
+
+def test_lib_farm_links_libraries_and_reports_conflicts(tmp_path, capsys):
+    from s390x_auto_path import envgen
+    for name, body in (('a', b'A'), ('b', b'B')):
+        lib = tmp_path / name / 'lib64'
+        (lib / 'pkgconfig').mkdir(parents=True)
+        (lib / 'libshared.so.1').write_bytes(body)
+        (lib / f'lib{name}.so').write_bytes(body)
+        (lib / 'pkgconfig' / f'{name}.pc').write_text(f'prefix=/opt/{name}\n')
+    (tmp_path / 'b' / 'lib64' / 'pkgconfig' / 'rel.pc').write_text('prefix=${pcfiledir}/../..\n')
+    paths = {'lib64': [str(tmp_path / 'a' / 'lib64'), str(tmp_path / 'b' / 'lib64')],
+             'pkgconfig': [str(tmp_path / 'a' / 'lib64' / 'pkgconfig'), str(tmp_path / 'b' / 'lib64' / 'pkgconfig')]}
+    farm = tmp_path / 'farm'
+    (farm).mkdir()
+    os.symlink('/nonexistent/libold.so', str(farm / 'libold.so'))
+    os.symlink('x', str(farm / f'liba.so.{os.getpid()}.tmp'))  # a crashed run's temp link
+    farmed, stats = envgen.build_lib_farm(farm, paths)
+    assert sorted(os.listdir(farm)) == ['.s390x-auto-path-farm.json', 'liba.so', 'libb.so', 'libold.so',
+                                        'libshared.so.1', 'pkgconfig']
+    assert os.readlink(str(farm / 'libshared.so.1')) == str(tmp_path / 'a' / 'lib64' / 'libshared.so.1')
+    assert stats['conflicts'] == [{'name': 'libshared.so.1', 'used': str(tmp_path / 'a' / 'lib64' / 'libshared.so.1'),
+                                   'ignored': [str(tmp_path / 'b' / 'lib64' / 'libshared.so.1')]}]
+    assert '[WARN] libshared.so.1' in capsys.readouterr().out
+    env = envgen.build_env_flags(farmed)
+    assert env['LD_LIBRARY_PATH'] == str(farm) and env['LDFLAGS'] == f'-L{farm}'
+    # b's .pc files use ${pcfiledir}, so that dir stays on the path instead of being farmed
+    assert env['PKG_CONFIG_PATH'] == f"{farm / 'pkgconfig'}:{tmp_path / 'b' / 'lib64' / 'pkgconfig'}"
+    assert envgen.build_lib_farm(farm, paths)[1]['changed'] == 0  # second run: links already in place
+    os.unlink(str(farm / 'liba.so'))
+    (farm / 'liba.so').write_bytes(b'mine')
+    assert envgen.build_lib_farm(farm, paths)[1]['changed'] == 0
+    assert (farm / 'liba.so').read_bytes() == b'mine' and 'liba.so is not a symlink' in capsys.readouterr().out
+    # only links an earlier run made are dropped; the user's own link stays
+    del paths['lib64'][1]
+    envgen.build_lib_farm(farm, paths)
+    assert not os.path.lexists(str(farm / 'libb.so')) and os.path.islink(str(farm / 'libold.so'))
+
+
+def test_fix_lib_layout_leaves_wheel_untouched(tmp_path):
+    import shutil
+    import zipfile
+    from s390x_auto_path import libfix
+    whl = tmp_path / 'demo-1.0-py3-none-any.whl'
+    with zipfile.ZipFile(whl, 'w') as zf:
+        zf.writestr('lib/libdemo.so.1', b'demo')
+    before = whl.read_bytes()
+    fixed = libfix.fix_lib_layout(whl)
+    try:
+        assert fixed.is_dir() and (fixed / 'lib64' / 'libdemo.so.1').read_bytes() == b'demo'
+        assert whl.read_bytes() == before
+    finally:
+        shutil.rmtree(str(fixed))
+
+def test_layout_plan_dry_run_and_link_modes(tmp_path, monkeypatch, capsys):
+    import sys
+    from s390x_auto_path import cli, libfix
+    base = _make_pkg(tmp_path / 'pkg')
+    (base / 'lib' / 'aws').mkdir()
+    (base / 'lib' / 'aws' / 'libaws.so.1').write_bytes(b'aws')
+    os.symlink('libcrypto.so.1', str(base / 'lib' / 'libcrypto.so'))
+    (base / 'lib64').mkdir()
+    (base / 'lib64' / 'libcrypto.so.1').write_bytes(b'')  # already mirrored: not planned
+    plan = libfix.plan_layout(base, mode='hardlink')
+    assert plan['dirs'] == ['lib64/aws']
+    assert sorted(plan['links']) == [['lib64/aws/libaws.so.1', 'lib/aws/libaws.so.1'], ['lib64/libcrypto.so', 'lib/libcrypto.so']]
+    monkeypatch.setattr(sys, 'argv', ['s390x-auto-path', 'fix', str(base), '--dry-run', '--link-mode', 'hardlink'])
+    cli.main()
+    out = capsys.readouterr().out
+    assert f"[PLAN] mkdir {base / 'lib64' / 'aws'}" in out and '[RESULT] 2 links and 1 directories planned' in out
+    assert not (base / 'lib64' / 'aws').exists()
+    libfix.fix_lib_layout(base, link_mode='hardlink')
+    assert os.path.samefile(str(base / 'lib64' / 'aws' / 'libaws.so.1'), str(base / 'lib' / 'aws' / 'libaws.so.1'))
+    assert os.readlink(str(base / 'lib64' / 'libcrypto.so')) == 'libcrypto.so.1'  # soname link stays a link
+    assert libfix.plan_layout(base)['links'] == []
+    other = _make_pkg(tmp_path / 'other')
+    stats = libfix.apply_layout(libfix.plan_layout(other, mode='reflink'))
+    assert stats['linked'] + stats['copied'] == 1 and not stats['errors']
+    assert not (other / 'lib64' / 'libcrypto.so.1').is_symlink()
+
+
+def test_cli_imports_subcommand_modules_lazily(tmp_path):
+    import subprocess
+    import sys
+    from s390x_auto_path import cli, libfix
+    assert cli._LINK_MODES == libfix.LINK_MODES
+    # the default invocation, which looks for a daemon socket first
+    code = ('import sys; from s390x_auto_path import cli; sys.argv = ["s390x-auto-path", "scan", "nope"]; '
+            'cli.main(); print(" ".join(sorted(sys.modules)))')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), XDG_CACHE_HOME=str(tmp_path), XDG_RUNTIME_DIR=str(tmp_path))
+    env.pop('S390X_AUTO_PATH_SOCKET', None)
+    out = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True).stdout.splitlines()
+    assert out[0] == 'nope: None'
+    mods = set(out[1].split())
+    assert 's390x_auto_path.resolver' in mods
+    assert not mods & {'s390x_auto_path.libfix', 's390x_auto_path.batch', 's390x_auto_path.cache', 'asyncio',
+                       'concurrent.futures', 'socketserver'}
+
+
+def test_session_api_returns_results_and_reuses_scans(tmp_path, monkeypatch, capsys):
+    import s390x_auto_path
+    from s390x_auto_path import envgen, fsindex, output
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    site = tmp_path / 'site'
+    _fake_dist(site, 'fake-aws-lc', 'fake_aws_lc')
+    _make_pkg(site / 'fake_aws_lc')
+    monkeypatch.syspath_prepend(str(site))
+    s = s390x_auto_path.Session(use_cache=False)
+    calls, walks = [], []
+    real_scan, real_walk = envgen.scan_package, fsindex.index_tree
+    monkeypatch.setattr(envgen, 'scan_package', lambda base, **kw: calls.append(base) or real_scan(base, **kw))
+    monkeypatch.setattr(fsindex, 'index_tree', lambda base: walks.append(base) or real_walk(base))
+    pkg = site / 'fake_aws_lc'
+    scan = s.scan(['fake-aws-lc', 'nope'])
+    assert scan.missing == ['nope'] and scan.paths['lib'] == [str(pkg / 'lib')]
+    assert not (pkg / 'lib64').exists()  # scan is read-only
+    env = s.env(['fake-aws-lc'], out=tmp_path / 'build_env.sh')
+    assert s.env(['fake-aws-lc']).env == env.env and len(calls) == 1  # second call reuses the scan
+    assert len(walks) == 1  # env scanned the tree scan() had already indexed
+    assert env.env['LD_LIBRARY_PATH'] == str(pkg / 'lib64') and env.out == str(tmp_path / 'build_env.sh')
+    assert (pkg / 'lib64' / 'libcrypto.so.1').is_symlink()
+    other = _make_pkg(tmp_path / 'other')
+    plan = s.fix(other, dry_run=True)
+    assert plan.links == [['lib64/libcrypto.so.1', 'lib/libcrypto.so.1']] and not (other / 'lib64').exists()
+    res = s.fix(other, rewrite_cmake=True)
+    assert res.stats['linked'] == 1 and not res.errors and res.rewrite['files_changed'] == 1
+    assert s.fix(other).links == []
+    report = s.validate(other)
+    assert report.ok and [so.file for so in report.libraries] == [str(other / 'lib' / 'libcrypto.so.1'),
+                                                                  str(other / 'lib64' / 'libcrypto.so.1')]
+    assert capsys.readouterr().out == '' and output.current() == 'text'
+
+
+def test_validate_cache_notices_library_added_to_search_path(tmp_path, monkeypatch, capsys):
+    import shutil
+    from s390x_auto_path import cache, validator
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    src = _dynload_so()
+    data = open(src, 'rb').read()
+    if b'libc.so.6\0' not in data:
+        pytest.skip('fixture does not link libc.so.6')
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'mod.so').write_bytes(data.replace(b'libc.so.6\0', b'libq.so.6\0', 1))
+    (tmp_path / 'b').mkdir()
+    monkeypatch.setenv('LD_LIBRARY_PATH', str(tmp_path / 'b'))
+    validator.run_validate(tmp_path / 'a', use_cache=True)
+    assert 'libq.so.6 not found' in capsys.readouterr().out
+    assert len(cache.values('elf')) == 1
+    shutil.copy(src, str(tmp_path / 'b' / 'libq.so.6'))
+    puts = []
+    monkeypatch.setattr(cache, 'put', lambda *a: puts.append(a))
+    validator.run_validate(tmp_path / 'a', use_cache=True)
+    assert 'libq.so.6 not found' not in capsys.readouterr().out
+    assert puts == []  # the target's files did not change: the entry is not rewritten
+
+
+def test_output_capture_is_per_thread():
+    import threading
+    from s390x_auto_path import output
+    got = {}
+
+    def work(name):
+        with output.capture() as records:
+            for i in range(200):
+                output.emit({'type': name, 'i': i})
+        got[name] = records
+    threads = [threading.Thread(target=work, args=(n,)) for n in ('a', 'b')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r['i'] for r in got['a']] == list(range(200)) and {r['type'] for r in got['a']} == {'a'}
+    assert {r['type'] for r in got['b']} == {'b'} and output.current() == 'text'